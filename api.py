@@ -0,0 +1,265 @@
+"""Versioned JSON API, mounted at /api/v1.
+
+Every listing returns {"data": [...], "next": <cursor or null>}; pass the
+cursor back as `before` (message listings) or `after` (user listings) for
+the next page, and `limit` for the page size (at most MAX_LIMIT).
+
+`fields` picks what each item contains, e.g. ?fields=id,text,user, and only
+what is asked for is loaded: the author is only joined for `user`, and the
+viewer's likes and follows are only looked up for `liked` and `followed`.
+
+The API uses the site's session for authentication; endpoints behind a login
+on the site answer 401 here without one.
+"""
+
+from flask import Blueprint, g, jsonify, request
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import BadRequest, HTTPException, Unauthorized
+
+from http_cache import cacheable, etag_for, not_modified
+from models import Message, TimelineEntry, User, with_author
+from pagination import paginate
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# field name -> column to load for it (None: not a column of the model)
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'user_id': Message.user_id,
+    'likes_count': Message.likes_count,
+    'user': None,
+    'liked': None,
+}
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+    'followed': None,
+}
+
+
+def requested_fields(available):
+    """The fields named in the 'fields' param (all of them by default).
+    Raises BadRequest for a field that doesn't exist."""
+
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = set(fields) - set(available)
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    return fields
+
+
+def requested_limit():
+    return min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1),
+               MAX_LIMIT)
+
+
+def require_login():
+    if not g.user:
+        raise Unauthorized("Log in to see this.")
+
+
+def load_message_fields(query, fields):
+    """`query`, loading only the columns behind `fields`, and the author
+    only for 'user'."""
+
+    columns = {Message.id, Message.timestamp, Message.user_id}
+    columns.update(MESSAGE_FIELDS[f] for f in fields if MESSAGE_FIELDS[f] is not None)
+    query = query.options(load_only(*columns))
+
+    if 'user' in fields:
+        query = query.options(with_author)
+
+    return query
+
+
+def project_messages(query, fields, timestamp_col=Message.timestamp,
+                     id_col=Message.id):
+    """A page of `query`'s messages as dicts of `fields`, plus the next
+    cursor. Only the columns behind `fields` are loaded."""
+
+    query = load_message_fields(query, fields)
+
+    messages, next_cursor = paginate(
+        query, timestamp_col, id_col,
+        cursor=request.args.get('before'),
+        per_page=requested_limit(),
+    )
+
+    liked = set()
+    if 'liked' in fields and g.user:
+        liked = g.user.liked_message_ids([msg.id for msg in messages])
+
+    return [message_dict(msg, fields, liked) for msg in messages], next_cursor
+
+
+def message_dict(msg, fields, liked=()):
+    item = {}
+
+    for field in fields:
+        if field == 'user':
+            item['user'] = {
+                'id': msg.user.id,
+                'username': msg.user.username,
+                'image_url': msg.user.image_url,
+            }
+        elif field == 'liked':
+            item['liked'] = msg.id in liked
+        elif field == 'timestamp':
+            item['timestamp'] = msg.timestamp.isoformat()
+        else:
+            item[field] = getattr(msg, field)
+
+    return item
+
+
+def project_users(query, fields):
+    """A page of `query`'s users, by id, as dicts of `fields`, plus the id
+    to continue after."""
+
+    columns = {USER_FIELDS[f] for f in fields if USER_FIELDS[f] is not None}
+    columns.add(User.id)
+
+    users = (query
+             .options(load_only(*columns))
+             .filter(User.id > request.args.get('after', 0, type=int))
+             .order_by(User.id)
+             .limit(requested_limit() + 1)
+             .all())
+
+    next_after = None
+    if len(users) > requested_limit():
+        users = users[:requested_limit()]
+        next_after = users[-1].id
+
+    followed = set()
+    if 'followed' in fields and g.user:
+        followed = g.user.following_ids_among([user.id for user in users])
+
+    items = []
+    for user in users:
+        item = {}
+        for field in fields:
+            if field == 'followed':
+                item['followed'] = user.id in followed
+            else:
+                item[field] = getattr(user, field)
+        items.append(item)
+
+    return items, next_after
+
+
+def respond(payload):
+    """JSON response for `payload`, answered with 304 if the client's copy
+    is current. Private: responses depend on who is asking."""
+
+    etag = etag_for(g.user.id if g.user else None, payload)
+    return not_modified(etag) or cacheable(jsonify(payload), etag)
+
+
+@api.errorhandler(HTTPException)
+def api_error(e):
+    return jsonify(error=e.description), e.code
+
+
+@api.route('/timeline')
+def timeline():
+    """The logged-in user's home timeline, newest first."""
+
+    require_login()
+    fields = requested_fields(MESSAGE_FIELDS)
+
+    items, next_cursor = project_messages(
+        Message.home_timeline(g.user.id), fields,
+        TimelineEntry.timestamp, TimelineEntry.message_id)
+
+    return respond({'data': items, 'next': next_cursor})
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    User.get_active_or_404(user_id, load_only(User.id, User.deleted_at))
+    fields = requested_fields(MESSAGE_FIELDS)
+
+    items, next_cursor = project_messages(
+        Message.query.filter_by(user_id=user_id), fields)
+
+    return respond({'data': items, 'next': next_cursor})
+
+
+@api.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """Messages a user has liked, newest first."""
+
+    require_login()
+    User.get_active_or_404(user_id, load_only(User.id, User.deleted_at))
+    fields = requested_fields(MESSAGE_FIELDS)
+
+    items, next_cursor = project_messages(Message.liked_by(user_id), fields)
+
+    return respond({'data': items, 'next': next_cursor})
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """Users following this user, by id."""
+
+    require_login()
+    User.get_active_or_404(user_id, load_only(User.id, User.deleted_at))
+    fields = requested_fields(USER_FIELDS)
+
+    items, next_after = project_users(User.followers_of(user_id), fields)
+
+    return respond({'data': items, 'next': next_after})
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """Users this user follows, by id."""
+
+    require_login()
+    User.get_active_or_404(user_id, load_only(User.id, User.deleted_at))
+    fields = requested_fields(USER_FIELDS)
+
+    items, next_after = project_users(User.followed_by(user_id), fields)
+
+    return respond({'data': items, 'next': next_after})
+
+
+@api.route('/messages/<int:message_id>')
+def message_detail(message_id):
+    """One message."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+
+    query = (Message
+             .query
+             .filter_by(id=message_id)
+             .filter(Message.user.has(User.deleted_at.is_(None))))
+    msg = load_message_fields(query, fields).first_or_404()
+
+    liked = set()
+    if 'liked' in fields and g.user:
+        liked = g.user.liked_message_ids([msg.id])
+
+    return respond({'data': message_dict(msg, fields, liked)})
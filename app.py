@@ -1,14 +1,35 @@
+import math
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, jsonify, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, jsonify, g, url_for, abort
 from flask_debugtoolbar import DebugToolbarExtension
 # from sqlalchemy.exc import IntegrityError
 from sqlalchemy import exc
 from werkzeug.exceptions import Unauthorized
 from flask_cors import CORS
+from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
+from whitenoise import WhiteNoise
 
+import assets
+from api import api
+from cache import FragmentCache, TTLCache
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm, CSRFForm
-from models import db, connect_db, User, Message, Like
+from fragments import FragmentCacheExtension
+from hashing import HashingBusy, calibrate
+from http_cache import cacheable, etag_for, not_modified, viewer_stamp
+from instrumentation import Instrumentation
+import loader
+from metrics import registry
+from models import (db, connect_db, hasher, User, Message, Follows, Like,
+                    TimelineEntry, with_author, user_card, user_card_columns)
+from pagination import paginate
+import pooling
+from replicas import Replicas
+from request_globals import LazyAppGlobals
+import schema
+from throttle import TokenBucketLimiter
 
 database_url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
 # fix incorrect database URIs currently returned by Heroku's pg setup
@@ -16,7 +37,33 @@ database_url = database_url.replace('postgres://', 'postgresql://')
 
 CURR_USER_KEY = "curr_user"
 
+USERS_PER_PAGE = 24
+MAX_SEARCH_PAGES = 20
+
+
+def env_flag(name):
+    """Whether the environment variable `name` is set to 1, true or yes.
+    Anything else, "0" and "false" included, leaves it off."""
+
+    return os.environ.get(name, '').strip().lower() in {'1', 'true', 'yes'}
+
+
 app = Flask(__name__)
+app.app_ctx_globals_class = LazyAppGlobals
+app.register_blueprint(api)
+# Trust this many proxies' X-Forwarded-For (Heroku's router adds one), so
+# request.remote_addr is the client's address rather than the router's.
+app.wsgi_app = ProxyFix(
+    app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXIES', 1)))
+
+# Built assets (`flask build-assets`) are served straight from WhiteNoise,
+# precompressed and cached as immutable; everything else under /static/ is
+# still served by Flask.
+app.wsgi_app = WhiteNoise(
+    app.wsgi_app, immutable_file_test=assets.is_immutable)
+dist_dir = os.path.join(app.root_path, assets.DIST_DIR)
+if os.path.isdir(dist_dir):
+    app.wsgi_app.add_files(dist_dir, prefix='static/dist/')
 cors = CORS(app)
 
 
@@ -26,40 +73,183 @@ cors = CORS(app)
     # os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 
+# Connection pool of each worker process (see pooling.py). DB_PGBOUNCER=1
+# keeps few idle connections, leaving the pooling to PgBouncer.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pooling.engine_options(
+    size=int(os.environ.get('DB_POOL_SIZE', 5)),
+    max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    recycle=int(os.environ.get('DB_POOL_RECYCLE', -1)),
+    pre_ping=env_flag('DB_POOL_PRE_PING'),
+    pgbouncer=env_flag('DB_PGBOUNCER'),
+)
+
+# Read replicas for GET requests, as a comma-separated list of URLs. A
+# replica more than REPLICA_MAX_LAG seconds behind is not read from, and
+# someone who has just made a change reads from the primary for
+# REPLICA_PIN_SECONDS. Connecting to a replica gives up after
+# REPLICA_CONNECT_TIMEOUT seconds, and a statement on one after
+# REPLICA_STATEMENT_TIMEOUT. See replicas.py.
+app.config['SQLALCHEMY_REPLICA_URLS'] = [
+    url.strip().replace('postgres://', 'postgresql://')
+    for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url.strip()
+]
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 5))
+app.config['REPLICA_CHECK_INTERVAL'] = float(
+    os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+app.config['REPLICA_PIN_SECONDS'] = float(
+    os.environ.get('REPLICA_PIN_SECONDS', 10))
+app.config['REPLICA_CONNECT_TIMEOUT'] = int(
+    os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+app.config['REPLICA_STATEMENT_TIMEOUT'] = float(
+    os.environ.get('REPLICA_STATEMENT_TIMEOUT', 5))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+
+# Password hashing: bcrypt cost of new hashes (see `flask calibrate-bcrypt`),
+# hashing processes per web worker, how many hashes may wait before logins
+# get a 503, and how long one may take.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', 2))
+app.config['BCRYPT_MAX_PENDING'] = int(os.environ.get('BCRYPT_MAX_PENDING', 16))
+app.config['BCRYPT_TIMEOUT'] = float(os.environ.get('BCRYPT_TIMEOUT', 5))
+
+# Accounts whose deletion would remove more rows than this (see
+# User.deletion_size) are marked deleted and purged in the background.
+app.config['DELETE_INLINE_MAX_ROWS'] = int(
+    os.environ.get('DELETE_INLINE_MAX_ROWS', 10000))
+
+# Fraction of requests that get a Server-Timing header and a JSON log line
+# with their SQL and template timings. Set it to 1 to profile every request.
+app.config['INSTRUMENTATION_SAMPLE_RATE'] = float(
+    os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.01))
+
+# The debug toolbar is for local development only: set DEBUG_TOOLBAR=1
+# (and run with FLASK_ENV=development) to turn it on.
+if env_flag('DEBUG_TOOLBAR'):
+    toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+# schema changes are migrations in migrations/versions: `flask db upgrade`
+migrate = Migrate(app, db)
+Replicas(app)
+hasher.init_app(app)
+Instrumentation(app)
+assets.Assets(app)
+
+# Rendered message list items, shared by every viewer (see fragments.py).
+# Sized in bytes of HTML per worker process.
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = FragmentCache(
+    max_bytes=int(os.environ.get('FRAGMENT_CACHE_BYTES', 8 * 1024 * 1024)))
+
+# the {% cache %} namespaces a message is rendered under
+MESSAGE_FRAGMENTS = ('message', 'profile-message')
+
+# Rows of recently seen logged-in users, so g.user rarely needs a query.
+# Each worker process has its own copy: keep the TTL short, since an edit
+# only invalidates the copy in the worker that handled it.
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 5)),
+)
+
+# Login attempts allowed per username and per client address: a burst, then
+# a steady rate per minute. Checked before any password hashing is done.
+login_user_limiter = TokenBucketLimiter(
+    rate=float(os.environ.get('LOGIN_USER_PER_MINUTE', 5)) / 60,
+    burst=int(os.environ.get('LOGIN_USER_BURST', 5)),
+    maxsize=int(os.environ.get('LOGIN_THROTTLE_KEYS', 10000)),
+)
+login_addr_limiter = TokenBucketLimiter(
+    rate=float(os.environ.get('LOGIN_ADDR_PER_MINUTE', 30)) / 60,
+    burst=int(os.environ.get('LOGIN_ADDR_BURST', 30)),
+    maxsize=int(os.environ.get('LOGIN_THROTTLE_KEYS', 10000)),
+)
+
+login_attempts = registry.counter(
+    'warbler_login_attempts_total',
+    "Login attempts, by outcome.")
+registry.gauge(
+    'warbler_login_throttle_keys',
+    "Usernames and addresses with a login throttle bucket.",
+    lambda: len(login_user_limiter) + len(login_addr_limiter))
+registry.gauge(
+    'warbler_fragment_cache_bytes',
+    "Size of the rendered fragment cache.",
+    lambda: app.jinja_env.fragment_cache.size)
+registry.gauge(
+    'warbler_login_throttle_evictions',
+    "Login throttle buckets evicted to stay within LOGIN_THROTTLE_KEYS.",
+    lambda: login_user_limiter.evictions + login_addr_limiter.evictions)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+@LazyAppGlobals.lazy('user')
+def load_current_user():
+    """If we're logged in, load curr user the first time g.user is used in a
+    request, from the user cache when possible. Otherwise g.user is None."""
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    if CURR_USER_KEY not in session:
+        return None
+
+    user_id = session[CURR_USER_KEY]
+    row = user_cache.get(user_id)
+
+    if row is not None:
+        return User.from_row(row)
+
+    user = User.query.get(user_id)
+    if user and user.deleted_at is not None:
+        user = None
+    if user:
+        user_cache.set(user_id, user.to_row())
+
+    return user
+
+
+@LazyAppGlobals.lazy('csrf_form')
+def load_csrf_form():
+    """add a wtform to g to protect csrf attack, built the first time a view
+    or template uses g.csrf_form in a request (the token it renders is
+    generated once per request by Flask-WTF)"""
 
+    return CSRFForm()
+
+
+def load_liked_message_ids(messages):
+    """Look up, in one query, which of the messages about to be rendered the
+    current user has liked; the like buttons read the result from g."""
+
+    if g.user:
+        g.liked_message_ids = g.user.liked_message_ids(
+            [msg.id for msg in messages])
     else:
-        g.user = None
-    
-@app.before_request
-def add_csrf_form_to_g():
-    """add a wtform to g to protect csrf attack"""
+        g.liked_message_ids = set()
+
+
+def load_following_ids(users):
+    """Look up, in one query, which of the users about to be rendered the
+    current user follows; the follow/unfollow buttons read the result from g."""
 
-    g.csrf_form = CSRFForm()
-    print(g.csrf_form.hidden_tag())
+    if g.user:
+        g.following_ids = g.user.following_ids_among(
+            [user.id for user in users])
+    else:
+        g.following_ids = set()
 
 
 def do_login(user):
     """Log in user."""
 
+    user_cache.invalidate(user.id)
     session[CURR_USER_KEY] = user.id
 
 
@@ -67,6 +257,7 @@ def do_logout():
     """Logout user."""
 
     if CURR_USER_KEY in session:
+        user_cache.invalidate(session[CURR_USER_KEY])
         del session[CURR_USER_KEY]
 
 
@@ -116,14 +307,30 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
+        username_key = form.username.data.lower()
+        wait = max(login_addr_limiter.acquire(request.remote_addr),
+                   login_user_limiter.acquire(username_key))
+
+        if wait:
+            login_attempts.inc(outcome='throttled')
+            flash("Too many login attempts. Please try again shortly.",
+                  'danger')
+            return (render_template('users/login.html', form=form), 429,
+                    {'Retry-After': str(math.ceil(wait))})
+
         user = User.authenticate(form.username.data,
                                  form.password.data)
 
         if user:
+            login_attempts.inc(outcome='success')
+            login_user_limiter.reset(username_key)
+            # authenticate may have upgraded an old password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
 
+        login_attempts.inc(outcome='failure')
         flash("Invalid credentials.", 'danger')
 
     return render_template('users/login.html', form=form)
@@ -148,28 +355,112 @@ def logout():
 
 @app.route('/users')
 def list_users():
-    """Page with listing of users.
+    """Page with listing of users, USERS_PER_PAGE at a time.
+
+    Without a search, users are listed by id; an 'after' param in
+    querystring continues the listing after that user id.
+
+    Can take a 'q' param in querystring to search by that username, and a
+    'page' param for further pages of search results (up to
+    MAX_SEARCH_PAGES).
 
-    Can take a 'q' param in querystring to search by that username.
+    Only the columns a user card shows are loaded.
     """
 
     search = request.args.get('q')
+    next_url = None
 
     if not search:
-        users = User.query.all()
+        after = request.args.get('after', 0, type=int)
+        users = (User
+                 .query
+                 .with_entities(*user_card_columns)
+                 .filter(User.id > after, User.deleted_at.is_(None))
+                 .order_by(User.id)
+                 .limit(USERS_PER_PAGE + 1)
+                 .all())
+
+        if len(users) > USERS_PER_PAGE:
+            users = users[:USERS_PER_PAGE]
+            next_url = url_for('list_users', after=users[-1].id)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = min(max(request.args.get('page', 1, type=int), 1),
+                   MAX_SEARCH_PAGES)
+        users = (User
+                 .search(search)
+                 .with_entities(*user_card_columns)
+                 .offset((page - 1) * USERS_PER_PAGE)
+                 .limit(USERS_PER_PAGE + 1)
+                 .all())
 
-    return render_template('users/index.html', users=users)
+        if len(users) > USERS_PER_PAGE and page < MAX_SEARCH_PAGES:
+            next_url = url_for('list_users', q=search, page=page + 1)
+        users = users[:USERS_PER_PAGE]
+
+    load_following_ids(users)
+
+    return render_template('users/index.html',
+        users=users,
+        next_url=next_url)
+
+
+@app.route('/users/typeahead')
+def users_typeahead():
+    """Suggest users whose username starts with the 'q' param in querystring.
+
+    Returns JSON like {"users": [{"id", "username", "image_url"}, ...]}
+    """
+
+    search = request.args.get('q', '').strip()
+
+    if not search:
+        return jsonify(users=[])
+
+    users = [
+        {"id": id, "username": username, "image_url": image_url}
+        for id, username, image_url in User.typeahead(search)
+    ]
+
+    # the same for everyone, so shared caches may keep it briefly
+    etag = etag_for(users)
+    return (not_modified(etag, public=True, max_age=60)
+            or cacheable(jsonify(users=users), etag, public=True, max_age=60))
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
-    
-    user = User.query.get_or_404(user_id)
-    
-    return render_template('users/show.html', user=user)
+    """Show user profile with a page of their messages, newest first.
+
+    Takes a 'before' cursor param in querystring to show older messages.
+    """
+
+    user = User.get_active_or_404(user_id)
+
+    messages, next_cursor = paginate(
+        Message.query.filter_by(user_id=user.id),
+        Message.timestamp,
+        Message.id,
+        cursor=request.args.get('before'),
+    )
+    load_liked_message_ids(messages)
+    load_following_ids([user])
+
+    etag = etag_for(
+        viewer_stamp(),
+        (user.id, user.username, user.image_url, user.header_image_url,
+         user.bio, user.location, user.messages_count, user.following_count,
+         user.followers_count, user.likes_count),
+        [msg.id for msg in messages],
+        next_cursor,
+        sorted(g.liked_message_ids),
+        user.id in g.following_ids,
+    )
+    return not_modified(etag) or cacheable(
+        render_template('users/show.html',
+            user=user,
+            messages=messages,
+            next_cursor=next_cursor),
+        etag)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -180,8 +471,13 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.get_active_or_404(user_id)
+    following = User.followed_by(user.id).options(user_card).all()
+    load_following_ids(following + [user])
+
+    return render_template('users/following.html',
+        user=user,
+        following=following)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -192,8 +488,13 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.get_active_or_404(user_id)
+    followers = User.followers_of(user.id).options(user_card).all()
+    load_following_ids(followers + [user])
+
+    return render_template('users/followers.html',
+        user=user,
+        followers=followers)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -204,11 +505,22 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    if follow_id == g.user.id:
+        flash("You can't follow yourself.", "danger")
+        return redirect(f"/users/{g.user.id}/following")
+
     if g.csrf_form.validate_on_submit():
 
-        followed_user = User.query.get_or_404(follow_id)
-        g.user.following.append(followed_user)
-        db.session.commit()
+        followed_user = User.get_active_or_404(follow_id)
+
+        # the row is written directly: g.user.following would load everyone
+        # the user follows
+        if Follows.follow(g.user.id, followed_user.id):
+            TimelineEntry.add_followed(g.user.id, followed_user.id)
+            User.adjust_counts(User.id == g.user.id, following_count=1)
+            User.adjust_counts(User.id == followed_user.id, followers_count=1)
+            db.session.commit()
+            user_cache.invalidate(g.user.id)
 
     else:
         raise Unauthorized()
@@ -226,9 +538,14 @@ def stop_following(follow_id):
 
     if g.csrf_form.validate_on_submit():
 
-        followed_user = User.query.get(follow_id)
-        g.user.following.remove(followed_user)
-        db.session.commit()
+        followed_user = User.query.get_or_404(follow_id)
+
+        if Follows.unfollow(g.user.id, followed_user.id):
+            TimelineEntry.remove_followed(g.user.id, followed_user.id)
+            User.adjust_counts(User.id == g.user.id, following_count=-1)
+            User.adjust_counts(User.id == followed_user.id, followers_count=-1)
+            db.session.commit()
+            user_cache.invalidate(g.user.id)
 
     else:
         raise Unauthorized()
@@ -264,6 +581,7 @@ def profile():
             g.user.bio = bio
 
             db.session.commit()
+            user_cache.invalidate(g.user.id)
 
         else:
 
@@ -286,14 +604,19 @@ def delete_user(user_id):
         
     if g.csrf_form.validate_on_submit():
 
+        user_cache.invalidate(g.user.id)
+
         if g.user.id == user_id:
 
             do_logout()
 
-        for message in g.user.messages:
-            db.session.delete(message)
-        
-        db.session.delete(g.user)
+        # large accounts are hidden now and removed by `flask
+        # purge-deleted-users`, rather than tying up this request
+        if g.user.deletion_size() > app.config['DELETE_INLINE_MAX_ROWS']:
+            g.user.mark_deleted()
+        else:
+            g.user.delete_account()
+
         db.session.commit()
         
         return redirect("/signup")
@@ -306,9 +629,14 @@ def delete_user(user_id):
 def liked_messages(user_id):
     """Display all messages that are liked by current user"""
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
+    messages = Message.liked_by(user.id).options(with_author).all()
+    load_liked_message_ids(messages)
+    load_following_ids([user])
 
-    return render_template('users/likes.html', user=user)
+    return render_template('users/likes.html',
+        user=user,
+        messages=messages)
 
 
 
@@ -329,9 +657,15 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        # added directly: appending to g.user.messages would load every
+        # message the user has posted
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        User.adjust_counts(User.id == g.user.id, messages_count=1)
         db.session.commit()
+        user_cache.invalidate(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -342,10 +676,28 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    
-    return render_template('messages/show.html',
-        msg=msg)
+    msg = (Message
+           .query
+           .options(with_author)
+           .filter_by(id=message_id)
+           .first_or_404())
+    if msg.user.deleted_at is not None:
+        abort(404)
+    load_liked_message_ids([msg])
+    load_following_ids([msg.user])
+
+    # a message's text and timestamp never change
+    etag = etag_for(
+        viewer_stamp(),
+        msg.id,
+        (msg.user.id, msg.user.username, msg.user.image_url),
+        msg.id in g.liked_message_ids,
+        msg.user.id in g.following_ids,
+    )
+    return not_modified(etag) or cacheable(
+        render_template('messages/show.html',
+            msg=msg),
+        etag)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -362,8 +714,12 @@ def messages_destroy(message_id):
     if g.csrf_form.validate_on_submit():
 
         if g.user.id == msg.user.id:    
+            msg.release_counts()
             db.session.delete(msg)
             db.session.commit()
+            user_cache.invalidate(g.user.id)
+            for namespace in MESSAGE_FRAGMENTS:
+                app.jinja_env.fragment_cache.invalidate((namespace, msg.id))
 
         return redirect(f"/users/{g.user.id}")
 
@@ -373,11 +729,12 @@ def messages_destroy(message_id):
 
 
 
-@app.route('/messages/<int:message_id>/like', methods=["POST"])
+@app.route('/messages/<int:message_id>/like', methods=["PUT", "DELETE"])
 def message_like_or_unlike(message_id):
-    """Like/Unlike a message"""
+    """Like (PUT) or unlike (DELETE) a message.
 
-    message = Message.query.get_or_404(message_id)
+    Both are idempotent. Returns JSON like {"liked": true, "likes_count": 3}
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -386,24 +743,23 @@ def message_like_or_unlike(message_id):
         user_id = g.user.id
 
     if g.csrf_form.validate_on_submit():
-        if message.is_liked_by(g.user):
-            like = Like.query.get_or_404((user_id, message_id))
-            db.session.delete(like)
+        if request.method == "PUT":
+            likes_count = Like.like(user_id, message_id)
         else:
-            liked_msg = Like(user_id=user_id, message_id=message_id)
-            db.session.add(liked_msg)
+            likes_count = Like.unlike(user_id, message_id)
+
+        if likes_count is None:
+            db.session.rollback()
+            abort(404)
 
         db.session.commit()
+        user_cache.invalidate(user_id)
 
     else:
         raise Unauthorized()
 
-    # return redirect(f'/messages/{message_id}')
-    # breakpoint()
-    message = message.serialize()
-    
-    return jsonify(message)
-    
+    return jsonify(liked=request.method == "PUT", likes_count=likes_count)
+
 
 
 ##############################################################################
@@ -415,43 +771,168 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, with a
+      'before' cursor param in querystring for older pages
     """
 
     if g.user:
-        following_ids = [followee.id for followee in g.user.following]
-        following_ids.append(g.user.id)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        messages, next_cursor = paginate(
+            Message.home_timeline(g.user.id).options(with_author),
+            TimelineEntry.timestamp,
+            TimelineEntry.message_id,
+            cursor=request.args.get('before'),
+        )
+        load_liked_message_ids(messages)
 
         return render_template('home.html', 
-        messages=messages)
+        messages=messages,
+        next_cursor=next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
+@app.route('/metrics')
+def show_metrics():
+    """This worker's metrics, in the Prometheus text format.
+
+    If METRICS_TOKEN is set, it must be sent as a bearer token.
+    """
+
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        raise Unauthorized()
+
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     # note that we set the 404 status explicitly
     return render_template('404.html', e=e), 404
 
 
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """Too many logins at once: ask the client to come back shortly."""
+
+    db.session.rollback()
+    return render_template('404.html', e=e), 503, {'Retry-After': '1'}
+
+
+##############################################################################
+# CLI commands
+
+
+@app.cli.command('backfill-timelines')
+def backfill_timelines():
+    """Rebuild every home timeline from the messages and follows tables."""
+
+    total = 0
+    for written in TimelineEntry.rebuild():
+        total += written
+        print(f"{total} timeline entries written")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute the denormalized counters on users and messages, repairing
+    any that have drifted from the underlying tables."""
+
+    for model in (User, Message):
+        repaired = sum(model.reconcile_counts())
+        print(f"{repaired} {model.__tablename__} rows repaired")
+
+
+@app.cli.command('purge-deleted-users')
+@click.option('--batch-size', default=1000, show_default=True,
+              help="Rows deleted per transaction.")
+def purge_deleted_users(batch_size):
+    """Remove the accounts marked deleted, and everything that was theirs,
+    in small batches."""
+
+    user_ids = [user_id for (user_id,) in (db.session
+                                           .query(User.id)
+                                           .filter(User.deleted_at.isnot(None))
+                                           .order_by(User.deleted_at))]
+
+    for user_id in user_ids:
+        totals = {}
+        for step, deleted in User.purge(user_id, batch_size):
+            totals[step] = totals.get(step, 0) + deleted
+            print(f"user #{user_id}: {totals[step]} {step} deleted")
+
+
+@app.cli.command('load-csvs')
+@click.argument('directory', default='generator')
+@click.option('--reset', is_flag=True,
+              help="Drop and recreate every table before loading.")
+@click.option('--chunk-rows', default=loader.CHUNK_ROWS, show_default=True,
+              help="Rows sent to COPY per transaction.")
+def load_csvs(directory, reset, chunk_rows):
+    """Bulk-load users.csv, messages.csv, follows.csv and likes.csv from
+    DIRECTORY with COPY, adding to the rows already loaded."""
+
+    if reset:
+        schema.reset()
+
+    loader.load(directory, chunk_rows)
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """Compare the database's indexes with those declared on the models,
+    and exit non-zero if they differ."""
+
+    problems = schema.index_drift()
+
+    for problem in problems:
+        print(problem)
+
+    if problems:
+        raise SystemExit(1)
+
+    print("indexes match the models")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Write fingerprinted, compressed copies of the static files to
+    static/dist, for serving with far-future cache headers."""
+
+    manifest = assets.build(
+        os.path.join(app.root_path, assets.STATIC_DIR),
+        os.path.join(app.root_path, assets.DIST_DIR))
+
+    for source, built in sorted(manifest.items()):
+        print(f"{source} -> {built}")
+
+
+@app.cli.command('calibrate-bcrypt')
+@click.option('--target-ms', default=250, show_default=True,
+              help="Longest acceptable time for one hash, in milliseconds.")
+def calibrate_bcrypt(target_ms):
+    """Time bcrypt on this host and suggest a BCRYPT_LOG_ROUNDS setting."""
+
+    rounds, timings = calibrate(target_ms)
+
+    for cost, elapsed_ms in timings:
+        print(f"cost {cost:2}: {elapsed_ms:8.1f} ms")
+
+    print(f"BCRYPT_LOG_ROUNDS={rounds}")
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Default cache policy
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Views that can be cached say so with http_cache.cacheable, and static files
+# get Flask's own headers; anything else must not be stored.
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to responses without a cache policy."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if 'Cache-Control' not in response.headers:
+        response.cache_control.no_store = True
     return response
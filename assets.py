@@ -0,0 +1,132 @@
+"""Build fingerprinted, precompressed copies of the static files.
+
+`build` copies every file under static/ to static/dist/ with a hash of its
+contents in the name (style.css -> style.3f2a9c1b7d4e.css), writes gzip and,
+if the brotli package is installed, brotli versions next to the compressible
+ones, and records the mapping in static/dist/manifest.json. A changed file
+gets a new name, so the built files can be cached forever.
+
+Templates link to assets through `asset_url`, which uses the manifest when
+one has been built and falls back to the plain /static/ URL otherwise.
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+from hashlib import sha256
+
+from flask import url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = 'static'
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html'}
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+
+# url("/static/images/nav-bg.png") and friends, in stylesheets
+CSS_URL = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def _hashed_name(path, content):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    if os.path.splitext(path)[1] in COMPRESSIBLE:
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content))
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Rebuild `dist_dir` from the files in `static_dir`. Returns the
+    manifest, a dict of source path -> built path, both relative to
+    `static_dir` and `dist_dir`."""
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    sources = []
+    dist = os.path.abspath(dist_dir)
+
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs
+                   if os.path.abspath(os.path.join(root, d)) != dist]
+        for name in files:
+            sources.append(os.path.relpath(os.path.join(root, name), static_dir))
+
+    # stylesheets last, so their url()s can point at built images
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+    manifest = {}
+
+    for path in sources:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            content = CSS_URL.sub(
+                lambda m: (f'url({m.group(1)}/static/dist/{manifest[m.group(2)]}{m.group(1)})'
+                           if m.group(2) in manifest else m.group(0)),
+                content.decode('UTF-8')).encode('UTF-8')
+
+        built = _hashed_name(path, content).replace(os.sep, '/')
+        _write(os.path.join(dist_dir, built), content)
+        manifest[path.replace(os.sep, '/')] = built
+
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(dist_dir=DIST_DIR):
+    """The manifest written by `build`, or {} if it hasn't been run."""
+
+    try:
+        with open(os.path.join(dist_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def is_immutable(path, url):
+    """WhiteNoise test: built files, whose names carry their hash, never
+    change."""
+
+    return bool(HASHED_NAME.search(url))
+
+
+class Assets:
+    """Makes `asset_url(path)` available in templates."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.manifest = load_manifest(os.path.join(app.root_path, DIST_DIR))
+        app.add_template_global(self.asset_url)
+
+    def asset_url(self, path):
+        """URL of the static file at `path` (relative to static/)."""
+
+        built = self.manifest.get(path)
+        if built is None:
+            return url_for('static', filename=path)
+        return url_for('static', filename=f"dist/{built}")
@@ -0,0 +1,177 @@
+"""Benchmark Warbler's main routes against a seeded database.
+
+    python benchmark.py --users 2000 --messages 20000 --follows 100000
+
+Seeds BENCHMARK_DATABASE_URL (default postgresql:///warbler-bench) with
+generated data, then requests each route through the Flask test client as
+the user who follows the most people. Reports latency percentiles and the
+most SQL statements any one request ran, and exits non-zero if a route
+goes over its budget.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import quantiles
+from time import perf_counter
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCHMARK_DATABASE_URL', "postgresql:///warbler-bench")
+# keep the viewer cached for the whole run, so statement counts are those of
+# a steady state rather than depending on when the cache entry expires
+os.environ['USER_CACHE_TTL'] = '3600'
+
+from sqlalchemy import event
+
+import loader
+import schema
+from app import app, CURR_USER_KEY
+from models import db, User, Message
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+# route: (most SQL statements per request, 95th percentile latency in ms),
+# for the default dataset size. Statement counts are exact, so a new lazy
+# load fails the run; latencies leave about 2x headroom.
+BUDGETS = {
+    'homepage': (2, 50),
+    'list_users': (2, 25),
+    'users_show': (4, 25),
+    'show_following': (2, 250),
+    'users_followers': (3, 400),
+    'liked_messages': (4, 25),
+    'messages_show': (3, 20),
+    'messages_like': (2, 40),
+}
+
+
+class StatementCounter:
+    """Counts the SQL statements the app's engine runs."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def seed(args):
+    """Generate a dataset of the requested size and load it."""
+
+    with tempfile.TemporaryDirectory() as out:
+        subprocess.run([
+            sys.executable, os.path.join('generator', 'create_csvs.py'),
+            '--out', out,
+            '--users', str(args.users),
+            '--messages', str(args.messages),
+            '--follows', str(args.follows),
+            '--likes', str(args.likes),
+        ], check=True)
+
+        with app.app_context():
+            schema.reset()
+            loader.load(out)
+
+
+def route_urls():
+    """The URL requested for each route, chosen to be among the heaviest:
+    the viewer follows the most users, and the profile pages are those of
+    the most followed user."""
+
+    viewer = User.query.order_by(User.following_count.desc()).first()
+    popular = User.query.order_by(User.followers_count.desc()).first()
+    message = Message.query.order_by(Message.likes_count.desc()).first()
+
+    return viewer, {
+        'homepage': ('GET', "/"),
+        'list_users': ('GET', f"/users?q={popular.username[:3]}"),
+        'users_show': ('GET', f"/users/{popular.id}"),
+        'show_following': ('GET', f"/users/{viewer.id}/following"),
+        'users_followers': ('GET', f"/users/{popular.id}/followers"),
+        'liked_messages': ('GET', f"/users/{viewer.id}/likes"),
+        'messages_show': ('GET', f"/messages/{message.id}"),
+        'messages_like': ('PUT', f"/messages/{message.id}/like"),
+    }
+
+
+def run(client, counter, method, url, requests):
+    """Request `url` `requests` times; returns (latencies in ms, most
+    statements run by one request)."""
+
+    latencies = []
+    most_statements = 0
+
+    for i in range(requests):
+        # alternate like and unlike, so every request changes something
+        if method == 'PUT' and i % 2:
+            method_i = 'DELETE'
+        else:
+            method_i = method
+
+        counter.count = 0
+        start = perf_counter()
+        response = client.open(url, method=method_i)
+        latencies.append((perf_counter() - start) * 1000)
+        most_statements = max(most_statements, counter.count)
+
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method_i} {url}: {response.status_code}")
+
+    return latencies, most_statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=100000)
+    parser.add_argument('--likes', type=int, default=50000)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="reuse the data already in the database")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="requests per route, after a warm-up request")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="multiply every latency budget, for slow hosts")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args)
+
+    viewer, urls = route_urls()
+    counter = StatementCounter(db.engine)
+    over_budget = []
+
+    print(f"{'route':<16} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>4}")
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = viewer.id
+
+        for route, (method, url) in urls.items():
+            run(client, counter, method, url, 1)
+            latencies, statements = run(
+                client, counter, method, url, args.requests)
+
+            p50, p95, p99 = (quantiles(latencies, n=100)[i] for i in (49, 94, 98))
+            print(f"{route:<16} {p50:8.1f} {p95:8.1f} {p99:8.1f} {statements:4}")
+
+            max_statements, max_p95 = BUDGETS[route]
+            if statements > max_statements:
+                over_budget.append(
+                    f"{route}: {statements} SQL statements, budget {max_statements}")
+            if p95 > max_p95 * args.latency_scale:
+                over_budget.append(
+                    f"{route}: p95 {p95:.1f} ms, budget {max_p95 * args.latency_scale:.0f} ms")
+
+    for problem in over_budget:
+        print(f"OVER BUDGET {problem}")
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
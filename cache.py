@@ -0,0 +1,128 @@
+"""Small in-process caches shared by the request workers' threads."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    """A size-bounded mapping whose entries expire `ttl` seconds after they
+    were stored.
+
+    When full, the least recently used entry is evicted. Safe to share
+    between threads.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Return the live value stored under `key`, or `default`."""
+
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+
+            if expires <= monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting the oldest entries if full."""
+
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCache:
+    """Rendered template fragments, each stored under a key with a version.
+
+    A fragment is only returned while the version it was stored with still
+    matches, so a fragment whose inputs change is simply re-rendered. The
+    cache holds at most `max_bytes` of (UTF-8) text, evicting the least
+    recently used fragments beyond that. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, version):
+        """The fragment stored under `key` at `version`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, fragment):
+        """Store `fragment` under `key` at `version`, replacing any older
+        version and evicting the oldest fragments if over `max_bytes`."""
+
+        size = len(fragment.encode('UTF-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (version, fragment, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        """Drop every fragment."""
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,64 @@
+"""A `{% cache %}` tag for Jinja templates, backed by `cache.FragmentCache`.
+
+    {% cache "message", msg.id, msg.user.username, msg.user.image_url %}
+      ... markup that depends only on those values ...
+    {% endcache %}
+
+The first two arguments name the fragment; any others are its version, and
+a change to them re-renders it. Anything that differs between viewers (like
+buttons, CSRF tokens) belongs outside the tag.
+"""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from metrics import registry
+
+fragment_lookups = registry.counter(
+    'warbler_fragment_cache_lookups_total',
+    "Template fragment cache lookups, by result.")
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the `cache` tag. Set `environment.fragment_cache` to a
+    FragmentCache to turn caching on; while it is None, the tag just renders
+    its body."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        namespace, id, *version = args
+        key = (namespace, id)
+        version = tuple(version)
+
+        fragment = cache.get(key, version)
+        if fragment is None:
+            fragment_lookups.inc(result='miss')
+            fragment = str(caller())
+            cache.set(key, version, fragment)
+        else:
+            fragment_lookups.inc(result='hit')
+
+        return Markup(fragment)
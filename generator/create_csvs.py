@@ -3,26 +3,59 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Run it from the repository root, then load the files with `flask load-csvs`:
+
+    python generator/create_csvs.py --users 1000000 --follows 100000000
+
+Everything is generated offline and streamed to disk, so memory stays flat
+at any size. Users are split into shards that are generated in parallel, one
+process per core. Who follows whom, who posts and which messages get liked
+all follow power laws, and users post in bursts, so the data has the skew
+of a real social graph. The same --seed gives the same rows, with
+timestamps relative to the day the script runs.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+from collections import namedtuple
+from datetime import datetime
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import (PowerLaw, bursty_timestamps, distinct_draws,
+                     heavy_tailed_count, years_before)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+
+CSV_HEADERS = {
+    'users': USERS_CSV_HEADERS,
+    'messages': MESSAGES_CSV_HEADERS,
+    'follows': FOLLOWS_CSV_HEADERS,
+    'likes': LIKES_CSV_HEADERS,
+}
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 3000
+
+USERS_PER_SHARD = 20_000
+
+# most anyone follows, or likes
+MAX_FOLLOWING = 100_000
+MAX_LIKES = 10_000
 
-fake = Faker()
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
 # Generate random profile image URLs to use for users
 
@@ -32,46 +65,242 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header image URLs to use for users, from splashbase
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh0n9pHJW1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh0uemhCk1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh121HEWa1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh17lfd9R1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1d7s3UD1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1jdFvHR1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh1uhYnog1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh25vNOvI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh29fxz111st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mnh2m1hnS81st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo1h6tGOZf1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2wz2LTCs1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x3aAnRH1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x80NkDu1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2x9xqeef1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xbk8JUK1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xdqmle51st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xfarCvW1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xgqdEFn1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mo2xijE2nr1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq4kHmAg1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq69jlcS1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopq8fyQwI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqamedKu1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqc3ZZcz1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqdfx05t1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqfpSTPN1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqhxFulr1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqj9QUeq1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mopqkkwK2M1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6rzyNlAN1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s1hAudo1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s32zb6l1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s4dzqHA1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s661UgK1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s7lR1lS1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6s995bvI1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6sasSvPZ1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mp6scv2xrZ1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6f50W261st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6gwrYvm1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6l06zXi1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6poZxE51st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6tjdFhf1st5lhmo1_1280.jpg",
+    "https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_mpp6w0dxAm1st5lhmo1_1280.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+Config = namedtuple('Config', [
+    'users', 'messages', 'follows', 'likes', 'skew', 'years', 'seed', 'now',
+    'parts_dir',
+])
+
+
+def shard_rng(config, shard, purpose):
+    """A random generator for one purpose within one shard, seeded so every
+    run with the same seed repeats it exactly."""
+
+    return Random(f"{config.seed}:{shard}:{purpose}")
+
+
+def shard_users(config, shard):
+    first = shard * USERS_PER_SHARD + 1
+    return range(first, min(first + USERS_PER_SHARD, config.users + 1))
+
+
+def message_counts(config, shard):
+    """How many messages each user in `shard` posts. Repeatable, so both
+    passes agree on it."""
+
+    rng = shard_rng(config, shard, 'message-counts')
+    mean = config.messages / config.users
+
+    return [heavy_tailed_count(rng, mean, config.messages)
+            for _ in shard_users(config, shard)]
+
+
+def count_messages(args):
+    """First pass: the number of messages in a shard, so that the second
+    pass can number every shard's messages without coordinating."""
+
+    config, shard = args
+    return sum(message_counts(config, shard))
+
+
+def write_shard(args):
+    """Second pass: write one shard's users, messages, follows and likes to
+    part files. Returns the number of rows written to each."""
+
+    config, shard, first_message_id, total_messages = args
+
+    fake = Faker()
+    fake.seed_instance(f"{config.seed}:{shard}")
+    rng = shard_rng(config, shard, 'rows')
+
+    # a pool of sentences is far cheaper than asking Faker for every message
+    sentences = [fake.sentence() for _ in range(1000)]
+
+    users = PowerLaw(config.users, config.skew)
+    messages = PowerLaw(max(total_messages, 1), config.skew)
+    start = years_before(config.now, config.years)
+
+    paths = {table: os.path.join(config.parts_dir, f"{table}.{shard:06}.csv")
+             for table in CSV_HEADERS}
+    files = {table: open(path, 'w', newline='') for table, path in paths.items()}
+    writers = {table: csv.writer(f) for table, f in files.items()}
+    written = dict.fromkeys(CSV_HEADERS, 0)
+
+    message_id = first_message_id
+    counts = message_counts(config, shard)
+
+    try:
+        for user_id, message_count in zip(shard_users(config, shard), counts):
+            username = f"{fake.user_name()}_{user_id}"
+            writers['users'].writerow([
+                user_id,
+                f"{username}@{fake.free_email_domain()}",
+                username,
+                rng.choice(image_urls),
+                PASSWORD,
+                rng.choice(sentences),
+                rng.choice(header_image_urls),
+                fake.city(),
+            ])
+            written['users'] += 1
+
+            for timestamp in bursty_timestamps(rng, message_count, start, config.now):
+                text = " ".join(rng.sample(sentences, rng.randint(1, 3)))
+                writers['messages'].writerow([
+                    message_id,
+                    text[:MAX_WARBLER_LENGTH],
+                    timestamp.isoformat(sep=' '),
+                    user_id,
+                ])
+                message_id += 1
+                written['messages'] += 1
+
+            following = heavy_tailed_count(
+                rng, config.follows / config.users,
+                min(config.users - 1, MAX_FOLLOWING))
+            for followed_id in distinct_draws(rng, users, following, exclude=user_id):
+                writers['follows'].writerow([followed_id, user_id])
+                written['follows'] += 1
+
+            if total_messages:
+                liking = heavy_tailed_count(
+                    rng, config.likes / config.users,
+                    min(total_messages, MAX_LIKES))
+                for liked_id in distinct_draws(rng, messages, liking):
+                    writers['likes'].writerow([user_id, liked_id])
+                    written['likes'] += 1
+
+    finally:
+        for f in files.values():
+            f.close()
+
+    return written
+
+
+def combine_parts(config, out_dir, shards):
+    """Concatenate each table's part files, in shard order, under a header."""
+
+    for table, headers in CSV_HEADERS.items():
+        with open(os.path.join(out_dir, f"{table}.csv"), 'w', newline='') as out:
+            csv.writer(out).writerow(headers)
+
+            for shard in range(shards):
+                path = os.path.join(config.parts_dir, f"{table}.{shard:06}.csv")
+                with open(path, newline='') as part:
+                    shutil.copyfileobj(part, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES,
+                        help="roughly how many messages to generate")
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help="roughly how many follows to generate")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="roughly how many likes to generate")
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="power-law exponent of popularity")
+    parser.add_argument('--years', type=int, default=2,
+                        help="how many years of messages to spread out")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSV files to")
+    args = parser.parse_args()
+
+    parts_dir = os.path.join(args.out, '.parts')
+    os.makedirs(parts_dir, exist_ok=True)
+
+    config = Config(
+        users=args.users,
+        messages=args.messages,
+        follows=args.follows,
+        likes=args.likes,
+        skew=args.skew,
+        years=args.years,
+        seed=args.seed,
+        now=datetime.now().replace(microsecond=0),
+        parts_dir=parts_dir,
+    )
+    shards = -(-config.users // USERS_PER_SHARD)
+
+    try:
+        with Pool(args.workers) as pool:
+            per_shard = pool.map(
+                count_messages, [(config, shard) for shard in range(shards)])
+
+            total_messages = sum(per_shard)
+            first_ids = [1]
+            for count in per_shard[:-1]:
+                first_ids.append(first_ids[-1] + count)
+
+            totals = dict.fromkeys(CSV_HEADERS, 0)
+            tasks = [(config, shard, first_ids[shard], total_messages)
+                     for shard in range(shards)]
+
+            for done, written in enumerate(pool.imap_unordered(write_shard, tasks), 1):
+                for table, count in written.items():
+                    totals[table] += count
+                print(f"{done}/{shards} shards written")
+
+        combine_parts(config, args.out, shards)
+
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    for table, count in totals.items():
+        print(f"{table}.csv: {count} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,122 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import timedelta
+from math import gcd
 
+# Knuth's multiplicative hashing constant
+SCRAMBLE_MULTIPLIER = 2654435761
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+class PowerLaw:
+    """Draw ids 1..`n` with a Zipf-like skew: the id at popularity rank r is
+    drawn with probability roughly proportional to 1 / r ** `skew`.
 
-    return datetime.fromtimestamp(random_timestamp)
+    Ranks are mapped to ids with a multiplicative hash modulo `n` (a
+    bijection, since the multiplier is coprime with `n`), so popular ids are
+    scattered through the table instead of bunched at the start.
+    """
+
+    def __init__(self, n, skew=1.0):
+        self.n = n
+        self.skew = skew
+
+        self.multiplier = SCRAMBLE_MULTIPLIER % n or 1
+        while gcd(self.multiplier, n) != 1:
+            self.multiplier += 1
+
+    def rank(self, rng):
+        """A popularity rank in 0..n-1, 0 the most popular."""
+
+        u = rng.random()
+        m = self.n + 1
+
+        # inverse CDF of a power law on [1, n + 1); log-uniform when skew is 1
+        if self.skew == 1:
+            r = m ** u
+        else:
+            e = 1 - self.skew
+            r = ((m ** e - 1) * u + 1) ** (1 / e)
+
+        return min(int(r) - 1, self.n - 1)
+
+    def id_of(self, rank):
+        return (rank * self.multiplier) % self.n + 1
+
+    def draw(self, rng):
+        return self.id_of(self.rank(rng))
+
+
+def heavy_tailed_count(rng, mean, cap, alpha=2.0):
+    """A non-negative count with the given `mean` (before capping) and a
+    Pareto tail: most draws are small, a few are very large."""
+
+    scale = mean * (alpha - 1) / alpha
+    x = scale * rng.paretovariate(alpha)
+
+    # round up with probability the fractional part, so the mean holds
+    # even when it is only a count or two
+    count = int(x)
+    if rng.random() < x - count:
+        count += 1
+
+    return min(count, cap)
+
+
+def years_before(when, years):
+    """`when`, `years` years earlier. 29 February becomes the 28th in a
+    year without one."""
+
+    try:
+        return when.replace(year=when.year - years)
+    except ValueError:
+        return when.replace(year=when.year - years, day=28)
+
+
+def distinct_draws(rng, dist, count, exclude=None):
+    """Up to `count` distinct ids drawn from `dist`, skipping `exclude`.
+
+    Gives up after a bounded number of attempts, so asking for nearly every
+    id of a skewed distribution still finishes quickly.
+    """
+
+    drawn = set()
+    attempts = 0
+
+    while len(drawn) < count and attempts < 20 * count:
+        id = dist.draw(rng)
+        attempts += 1
+        if id != exclude:
+            drawn.add(id)
+
+    return drawn
+
+
+def bursty_timestamps(rng, count, start, end, mean_burst=4,
+                      mean_gap=timedelta(minutes=3)):
+    """`count` sorted timestamps between `start` and `end`, posted in bursts.
+
+    Bursts begin at random times, weighted towards the waking hours. Their
+    sizes are geometric with mean `mean_burst`. Within a burst, posts are
+    spaced by exponential gaps averaging `mean_gap`.
+    """
+
+    span = (end - start).total_seconds()
+    gap = mean_gap.total_seconds()
+    timestamps = []
+
+    while len(timestamps) < count:
+        burst_start = start + timedelta(seconds=rng.uniform(0, span))
+
+        # fewer bursts overnight: redraw most that land between 1am and 7am
+        if 1 <= burst_start.hour < 7 and rng.random() < 0.75:
+            continue
+
+        t = burst_start
+        while len(timestamps) < count:
+            timestamps.append(min(t, end))
+            t += timedelta(seconds=rng.expovariate(1 / gap))
+            if rng.random() < 1 / mean_burst:
+                break
+
+    timestamps.sort()
+    return timestamps
@@ -0,0 +1,201 @@
+"""Password hashing on a small, bounded pool of worker processes.
+
+bcrypt is deliberately slow, so hashing on the request thread lets a burst of
+logins occupy every web worker. Here hashes are computed in separate, lower
+priority processes. Only a limited number of hashes may be waiting at once;
+past that, or if a hash takes too long, requests fail fast with a 503.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+DEFAULT_ROUNDS = 12
+
+# bcrypt only looks at the first 72 bytes of a password; newer releases of
+# the library raise instead of truncating, so truncate here to keep existing
+# hashes verifying.
+MAX_PASSWORD_BYTES = 72
+
+
+class HashingBusy(ServiceUnavailable):
+    """The hashing pool is saturated, or a hash did not finish in time."""
+
+    description = "We're a little busy right now. Please try again shortly."
+
+
+def _encode(password):
+    return password.encode('UTF-8')[:MAX_PASSWORD_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(_encode(password), hashed.encode('UTF-8'))
+
+
+def _lower_priority(increment):
+    """Pool initializer: let page views win the CPU over password hashing."""
+
+    if increment and hasattr(os, 'nice'):
+        os.nice(increment)
+
+
+def hash_cost(hashed):
+    """The cost factor a bcrypt hash was made with, e.g. 12 for
+    '$2b$12$...'."""
+
+    return int(hashed.split('$')[2])
+
+
+def calibrate(target_ms, min_rounds=4, max_rounds=16):
+    """Time bcrypt on this host at increasing cost factors.
+
+    Returns (rounds, timings): the highest cost that hashes within
+    `target_ms` (or `min_rounds` if none does) and a list of (rounds, ms)
+    for each cost tried. Each step doubles the work, so timing stops at the
+    first cost over target.
+    """
+
+    chosen = min_rounds
+    timings = []
+
+    for rounds in range(min_rounds, max_rounds + 1):
+        start = time.perf_counter()
+        _hash("calibration password", rounds)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        timings.append((rounds, elapsed_ms))
+
+        if elapsed_ms > target_ms:
+            break
+        chosen = rounds
+
+    return chosen, timings
+
+
+class PasswordHasher:
+    """Hash and check passwords on a bounded process pool.
+
+    `workers` processes do the hashing (0 hashes inline on the calling
+    thread). At most `max_pending` hashes may be running or queued; past that
+    HashingBusy is raised straight away, as it is when a hash takes longer
+    than `timeout` seconds. `rounds` is the bcrypt cost of new hashes.
+
+    A worker dying (killed for memory, say) breaks the whole pool; it is
+    replaced with a new one and the hash tried again, and if that pool
+    breaks too the hash is done inline.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=16,
+                 timeout=5.0, nice=10):
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+        self.configure(rounds, workers, max_pending, timeout, nice)
+
+    def init_app(self, app):
+        """Configure from the app's BCRYPT_* settings."""
+
+        self.configure(
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+            workers=app.config.get('BCRYPT_WORKERS', 2),
+            max_pending=app.config.get('BCRYPT_MAX_PENDING', 16),
+            timeout=app.config.get('BCRYPT_TIMEOUT', 5.0),
+            nice=app.config.get('BCRYPT_NICE', 10),
+        )
+
+    def configure(self, rounds, workers, max_pending, timeout, nice):
+        self.shutdown()
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.nice = nice
+        self._slots = BoundedSemaphore(max(max_pending, 1))
+
+    def shutdown(self):
+        """Stop the worker processes; they are started again on demand."""
+
+        with self._lock:
+            if self._executor and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self):
+        # Start the pool on first use, in the process that uses it: a pool
+        # made before gunicorn forks its workers would not survive the fork.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_lower_priority,
+                    initargs=(self.nice,),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        """Stop using `executor`, a broken pool; the next use starts another."""
+
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+
+        for _ in range(2):
+            executor = self._get_executor()
+            try:
+                return self._run_on(executor, fn, *args)
+            except BrokenProcessPool:
+                self._discard(executor)
+
+        return fn(*args)
+
+    def _run_on(self, executor, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # A hash that times out keeps its worker busy until it finishes, so
+        # its slot is only given back then.
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HashingBusy()
+
+    def hash(self, password):
+        """Hash `password` at the configured cost; returns a str."""
+
+        return self._run(_hash, password, self.rounds).decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Does `password` match the stored hash `hashed`?"""
+
+        return self._run(_check, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a lower cost than new hashes get?"""
+
+        return hash_cost(hashed) < self.rounds
@@ -0,0 +1,73 @@
+"""Conditional GET: ETags and Cache-Control for pages and JSON responses.
+
+A view loads what it needs, builds an ETag from that data with `etag_for`
+(including `viewer_stamp()` for pages), and returns `not_modified(etag)` if
+the client already has that version; only otherwise does it render.
+`cacheable` adds the ETag and cache policy to the response it does render.
+"""
+
+from hashlib import blake2b
+from time import time
+
+from flask import current_app, g, make_response, request, session
+
+
+def etag_for(*parts):
+    """A strong ETag for a response built from `parts`: ids, timestamps,
+    counters and other small values."""
+
+    digest = blake2b(repr(parts).encode('UTF-8'), digest_size=16)
+    return digest.hexdigest()
+
+
+def viewer_stamp():
+    """What, beyond the view's own data, a page depends on: the logged-in
+    user's nav bar details, and the age of the CSRF tokens in its forms.
+
+    Tokens expire after WTF_CSRF_TIME_LIMIT seconds, so the stamp changes
+    every half of that; a page revalidated with 304 never carries a token
+    more than half-way to expiry.
+    """
+
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    csrf_bucket = int(time() // (time_limit / 2))
+
+    if g.user:
+        return (g.user.id, g.user.username, g.user.image_url, csrf_bucket)
+    return (None, csrf_bucket)
+
+
+def not_modified(etag, public=False, max_age=0):
+    """A 304 response if the request's If-None-Match has `etag`, else None.
+
+    Never 304 while flashed messages are waiting: the page has to be
+    rendered to show them.
+    """
+
+    if session.get('_flashes') or etag not in request.if_none_match:
+        return None
+
+    return cacheable(make_response('', 304), etag, public, max_age)
+
+
+def cacheable(response, etag, public=False, max_age=0):
+    """Add `etag` and a cache policy to `response`.
+
+    Pages are private: they carry CSRF tokens and per-user state, so only the
+    browser may keep them. `public` responses may also be stored by shared
+    caches and CDNs for `max_age` seconds. Either way the client revalidates
+    with If-None-Match once the copy is stale.
+    """
+
+    response = make_response(response)
+    response.set_etag(etag)
+
+    if public:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+
+    return response
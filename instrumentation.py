@@ -0,0 +1,153 @@
+"""Lightweight per-request profiling, cheap enough to leave on in production.
+
+For a sample of requests this records how many SQL statements ran, how long
+they took, the slowest of them and how long templates took to render. The
+timings go out in a Server-Timing header, where browser dev tools show them,
+and in one JSON log line per request.
+"""
+
+import json
+import logging
+import random
+import sys
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.requests')
+
+# longest SQL kept for the slowest statement in the log line
+MAX_STATEMENT_LENGTH = 500
+
+
+class RequestProfile:
+    """Timings collected during one request."""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.render_start = None
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record_query(self, statement, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def server_timing(self, total):
+        """The value of a Server-Timing header for these timings."""
+
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def _current_profile():
+    if has_request_context():
+        return g.get('_request_profile')
+    return None
+
+
+class Instrumentation:
+    """Profile a sampled fraction of an app's requests.
+
+    `sample_rate` (0 to 1) is read from the app's INSTRUMENTATION_SAMPLE_RATE
+    setting; requests that aren't sampled only pay for one random draw.
+    SQL is timed through engine events, so statements on every engine the
+    app uses are counted.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('INSTRUMENTATION_SAMPLE_RATE', 0.01)
+
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+        event.listen(Engine, 'before_cursor_execute', self._before_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_execute)
+        event.listen(Engine, 'handle_error', self._on_error)
+
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def _start_request(self):
+        if self.sample_rate and random.random() < self.sample_rate:
+            g._request_profile = RequestProfile()
+
+    def _finish_request(self, response):
+        profile = _current_profile()
+        if profile is None:
+            return response
+
+        total = perf_counter() - profile.start
+        response.headers['Server-Timing'] = profile.server_timing(total)
+
+        statement = profile.slowest_statement
+        if statement and len(statement) > MAX_STATEMENT_LENGTH:
+            statement = statement[:MAX_STATEMENT_LENGTH] + "..."
+
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 1),
+            'template_ms': round(profile.template_time * 1000, 1),
+            'slowest_ms': round(profile.slowest_time * 1000, 1),
+            'slowest_sql': statement,
+        }))
+
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if _current_profile() is not None:
+            conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        profile = _current_profile()
+        starts = conn.info.get('query_start')
+        if profile is not None and starts:
+            profile.record_query(statement, perf_counter() - starts.pop())
+
+    def _on_error(self, exception_context):
+        # a failed statement never reaches after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start'):
+            connection.info['query_start'].pop()
+
+    def _before_render(self, sender, template, context, **extra):
+        profile = _current_profile()
+        if profile is not None:
+            profile.render_start = perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        profile = _current_profile()
+        if profile is not None and profile.render_start is not None:
+            profile.template_time += perf_counter() - profile.render_start
+            profile.render_start = None
@@ -0,0 +1,198 @@
+"""Bulk-load CSV files into the database with Postgres COPY.
+
+Each CSV's header row names the columns it holds; any column left out gets
+its default (so a file without ids has them assigned by the sequence). Rows
+are streamed to COPY a chunk at a time, each chunk in its own transaction,
+so memory stays flat however big the files are.
+"""
+
+import csv
+import io
+import os
+import time
+from itertools import islice
+
+from sqlalchemy import text
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+# tables in an order that satisfies their foreign keys
+LOAD_ORDER = (User, Message, Follows, Like)
+
+CHUNK_ROWS = 100_000
+
+# the column of each table whose user's timeline a new row changes; a new
+# message also changes its author's followers' timelines
+TIMELINE_USER = {
+    'messages': 'user_id',
+    'follows': 'user_following_id',
+}
+
+AUTHORS_FOLLOWERS = text(
+    "SELECT DISTINCT user_following_id FROM follows "
+    "WHERE user_being_followed_id = ANY(:authors)")
+
+
+def _quote(table):
+    return db.engine.dialect.identifier_preparer.format_table(table)
+
+
+def copy_csv(table, path, chunk_rows=CHUNK_ROWS, collect=None):
+    """COPY the rows of the CSV file at `path` into `table`.
+
+    `collect` is an optional (column, set) pair: each copied row's value of
+    that column is added to the set, as an int. Yields the number of rows
+    copied by each chunk, after it commits.
+    """
+
+    preparer = db.engine.dialect.identifier_preparer
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+
+        unknown = set(columns) - set(table.columns.keys())
+        if unknown:
+            raise ValueError(
+                f"{path}: no such columns in {table.name}: "
+                f"{', '.join(sorted(unknown))}")
+
+        sql = (f"COPY {_quote(table)} "
+               f"({', '.join(preparer.quote(c) for c in columns)}) "
+               f"FROM STDIN WITH (FORMAT csv)")
+
+        while True:
+            rows = list(islice(reader, chunk_rows))
+            if not rows:
+                break
+
+            if collect is not None:
+                column, values = collect
+                position = columns.index(column)
+                values.update(int(row[position]) for row in rows)
+
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+
+            connection = db.engine.raw_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.copy_expert(sql, buffer)
+                connection.commit()
+            finally:
+                connection.close()
+
+            yield len(rows)
+
+
+def drop_indexes(tables):
+    """Drop the secondary indexes of `tables`, which are cheaper to build
+    once after a load than to maintain row by row during it. Returns the
+    dropped indexes, for `create_indexes`."""
+
+    dropped = [index for table in tables for index in table.indexes]
+    preparer = db.engine.dialect.identifier_preparer
+
+    # by name: checkfirst can't see expression indexes
+    for index in dropped:
+        db.session.execute(
+            text(f"DROP INDEX IF EXISTS {preparer.format_index(index)}"))
+    db.session.commit()
+
+    return dropped
+
+
+def create_indexes(indexes):
+    """Create `indexes` again after a load."""
+
+    for index in indexes:
+        index.create(db.engine)
+
+
+def reset_sequence(table):
+    """Move `table`'s id sequence past the largest id in the table, so rows
+    loaded with explicit ids don't collide with later inserts."""
+
+    db.session.execute(
+        text("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+             "coalesce(max(id), 1), max(id) IS NOT NULL) "
+             f"FROM {_quote(table)}"),
+        {'table': table.name})
+    db.session.commit()
+
+
+def load(directory, chunk_rows=CHUNK_ROWS, log=print):
+    """Load `users.csv`, `messages.csv`, `follows.csv` and `likes.csv` from
+    `directory`, skipping any that don't exist, then rebuild the timelines
+    the loaded rows change, and the counters.
+
+    Rows are added to what is already in the database. Progress, with rows
+    per second, is reported through `log`.
+    """
+
+    tables = [model.__table__ for model in LOAD_ORDER]
+    indexes = drop_indexes(tables)
+    timelines = {'messages': set(), 'follows': set()}
+
+    try:
+        for table in tables:
+            path = os.path.join(directory, f"{table.name}.csv")
+            if not os.path.exists(path):
+                log(f"{table.name}: no {path}, skipping")
+                continue
+
+            start = time.perf_counter()
+            total = 0
+
+            collect = None
+            if table.name in TIMELINE_USER:
+                collect = (TIMELINE_USER[table.name], timelines[table.name])
+
+            for copied in copy_csv(table, path, chunk_rows, collect):
+                total += copied
+                elapsed = time.perf_counter() - start
+                log(f"{table.name}: {total} rows, "
+                    f"{total / elapsed:,.0f} rows/s")
+
+            if 'id' in table.columns:
+                reset_sequence(table)
+
+    finally:
+        start = time.perf_counter()
+        create_indexes(indexes)
+        log(f"indexes rebuilt in {time.perf_counter() - start:.1f}s")
+
+    # the rebuild reads each followed user's newest messages off
+    # ix_messages_user_id_timestamp, so it waits for the indexes, and for
+    # statistics that say how big the loaded tables are
+    for table in tables:
+        db.session.execute(text(f"ANALYZE {_quote(table)}"))
+    db.session.commit()
+
+    authors = timelines['messages']
+    users = authors | timelines['follows']
+    if authors:
+        users.update(db.session.execute(
+            AUTHORS_FOLLOWERS, {'authors': list(authors)}).scalars())
+
+    # an existing timelines table keeps its indexes: only some of its rows
+    # are rewritten
+    timeline_indexes = []
+    if not db.session.query(TimelineEntry.query.exists()).scalar():
+        timeline_indexes = drop_indexes([TimelineEntry.__table__])
+
+    try:
+        start = time.perf_counter()
+        written = sum(TimelineEntry.rebuild(users))
+        log(f"timeline_entries: {written} rows for {len(users)} users in "
+            f"{time.perf_counter() - start:.1f}s")
+    finally:
+        create_indexes(timeline_indexes)
+
+    for model in (User, Message):
+        repaired = sum(model.reconcile_counts())
+        log(f"{model.__tablename__}: {repaired} counters set")
+
+    db.session.execute(text(f"ANALYZE {_quote(TimelineEntry.__table__)}"))
+    db.session.commit()
@@ -0,0 +1,141 @@
+"""Process-local counters and gauges, rendered in the Prometheus text format.
+
+Each web worker keeps its own values; scrape every worker, or sum across
+them, to get a picture of the whole app.
+"""
+
+from threading import Lock
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """A named family of values, one per distinct set of labels."""
+
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = Lock()
+
+    def samples(self):
+        """(labels, value) pairs for every label set seen so far."""
+
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{_format_labels(labels)} {value}"
+                     for labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down. If `fn` is given, it is called for the
+    current value each time the gauge is read."""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.fn is not None:
+            return [((), self.fn())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Observed values counted into cumulative `buckets` (upper bounds),
+    with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, count, total = self._values.get(
+                key, ([0] * len(self.buckets), 0, 0))
+            counts = list(counts)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, count + 1, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+
+        for labels, (counts, count, total) in self.samples():
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for bound, observed in zip(bounds, counts + [count]):
+                le = _format_labels(labels + (('le', bound),))
+                lines.append(f"{self.name}_bucket{le} {observed}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines)
+
+
+class Registry:
+    """The metrics a process exposes on /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def gauge(self, name, help, fn=None):
+        return self._register(Gauge(name, help, fn))
+
+    def histogram(self, name, help, buckets):
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
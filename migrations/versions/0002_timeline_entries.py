@@ -0,0 +1,68 @@
+"""timeline_entries: precomputed home timelines
+
+Filled from follows and messages the same way `flask backfill-timelines`
+does: each user's own messages, and the 100 most recent messages of each
+user they follow. Those are read off ix_messages_user_id_timestamp, which
+is built first.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 04:45:41.203118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from schema import build_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CONCURRENTLY can't run inside a transaction, so this comes before the
+    # transaction creating and filling the table
+    with op.get_context().autocommit_block():
+        build_index_concurrently(
+            op, 'ix_messages_user_id_timestamp', 'messages',
+            ['user_id', 'timestamp', 'id'])
+
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+
+    op.execute("""
+        INSERT INTO timeline_entries (user_id, message_id, timestamp)
+        SELECT follows.user_following_id, recent.id, recent.timestamp
+        FROM follows
+        CROSS JOIN LATERAL (
+            SELECT messages.id, messages.timestamp
+            FROM messages
+            WHERE messages.user_id = follows.user_being_followed_id
+            ORDER BY messages.timestamp DESC
+            LIMIT 100
+        ) AS recent
+        WHERE follows.user_following_id != follows.user_being_followed_id
+        UNION ALL
+        SELECT messages.user_id, messages.id, messages.timestamp
+        FROM messages
+    """)
+
+    op.create_index('ix_timeline_entries_user_id_timestamp', 'timeline_entries', ['user_id', 'timestamp', 'message_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timeline_entries_user_id_timestamp', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_user_id_timestamp', table_name='messages', postgresql_concurrently=True)
@@ -0,0 +1,52 @@
+"""denormalized counters on users and messages
+
+The new columns start at 0 and are then set from the rows they count, as
+`flask reconcile-counters` would.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 04:45:49.771530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+USER_COUNTERS = ('messages_count', 'following_count', 'followers_count',
+                 'likes_count')
+
+# counter -> (table counted, its column holding the counted row's id)
+SOURCES = {
+    ('users', 'messages_count'): ('messages', 'user_id'),
+    ('users', 'following_count'): ('follows', 'user_following_id'),
+    ('users', 'followers_count'): ('follows', 'user_being_followed_id'),
+    ('users', 'likes_count'): ('likes', 'user_id'),
+    ('messages', 'likes_count'): ('likes', 'message_id'),
+}
+
+
+def upgrade():
+    for name in USER_COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+    op.add_column('messages', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+
+    for (table, counter), (source, column) in SOURCES.items():
+        op.execute(f"""
+            UPDATE {table} SET {counter} = counted.rows
+            FROM (SELECT {column} AS id, count(*) AS rows
+                  FROM {source}
+                  GROUP BY {column}) AS counted
+            WHERE {table}.id = counted.id
+        """)
+
+
+def downgrade():
+    op.drop_column('messages', 'likes_count')
+    for name in reversed(USER_COUNTERS):
+        op.drop_column('users', name)
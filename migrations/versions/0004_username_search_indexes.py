@@ -0,0 +1,41 @@
+"""indexes for username search and typeahead
+
+A trigram index for substring search, and a lower(username) index for
+prefix matches, both built concurrently.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 04:45:57.318904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from schema import build_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        build_index_concurrently(
+            op, 'ix_users_username_trgm', 'users', ['username'],
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'})
+        build_index_concurrently(
+            op, 'ix_users_username_lower_prefix', 'users',
+            [sa.text('lower(username) text_pattern_ops')])
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_username_lower_prefix', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_users_username_trgm', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""account deletion: users.deleted_at
+
+Also indexes timeline_entries.message_id, which deleting a message's entries
+looks up by.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 04:46:05.664027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from schema import build_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    with op.get_context().autocommit_block():
+        build_index_concurrently(
+            op, 'ix_timeline_entries_message_id', 'timeline_entries',
+            ['message_id'])
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_timeline_entries_message_id', table_name='timeline_entries', postgresql_concurrently=True)
+
+    op.drop_column('users', 'deleted_at')
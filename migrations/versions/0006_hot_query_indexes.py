@@ -0,0 +1,42 @@
+"""indexes for who a user follows and a message's likers
+
+Built concurrently, so the tables stay writable while they build. The index
+for a user's messages came earlier, in 0002, for its backfill.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 05:02:11.418377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from schema import build_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    ('ix_follows_user_following_id', 'follows',
+     ['user_following_id', 'user_being_followed_id']),
+    ('ix_likes_message_id', 'likes',
+     ['message_id', 'user_id']),
+]
+
+
+def upgrade():
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            build_index_concurrently(op, name, table, columns)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -2,12 +2,42 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import backref
+from flask import abort
+from sqlalchemy import (DDL, case, delete, event, func, literal, or_, select,
+                        true, tuple_, union_all, update)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import (backref, joinedload, load_only,
+                            make_transient_to_detached)
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import UnaryExpression
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import PasswordHasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+hasher = PasswordHasher()
+
+# shortest search term the trigram index can help with
+MIN_TRIGRAM_TERM = 3
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in `term` with backslashes, Postgres's default
+    LIKE escape character."""
+
+    return (term
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def pattern_order(expression):
+    """ORDER BY `expression` in text_pattern_ops order (byte by byte, the
+    ~<~ operator), which an index built with text_pattern_ops can return
+    rows in. A plain ORDER BY uses the collation's order, so it can't."""
+
+    return UnaryExpression(
+        expression, modifier=operators.custom_op('USING ~<~'))
 
 
 class Follows(db.Model):
@@ -27,8 +57,91 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key serves lookups by the followed user; this serves the
+    # other direction (who a user follows)
+    __table_args__ = (
+        db.Index(
+            'ix_follows_user_following_id',
+            'user_following_id', 'user_being_followed_id',
+        ),
+    )
+
+    @classmethod
+    def follow(cls, user_id, followed_id):
+        """Have `user_id` follow `followed_id`, unless they already do.
+        Returns whether a follow was added."""
+
+        inserted = (pg_insert(cls)
+                    .values(user_following_id=user_id,
+                            user_being_followed_id=followed_id)
+                    .on_conflict_do_nothing()
+                    .returning(cls.user_following_id))
+
+        return db.session.execute(inserted).first() is not None
+
+    @classmethod
+    def unfollow(cls, user_id, followed_id):
+        """Have `user_id` stop following `followed_id`, if they do. Returns
+        whether a follow was removed."""
+
+        deleted = (delete(cls)
+                   .where(cls.user_following_id == user_id,
+                          cls.user_being_followed_id == followed_id)
+                   .returning(cls.user_following_id)
+                   .execution_options(synchronize_session=False))
+
+        return db.session.execute(deleted).first() is not None
+
+
+class CounterMixin:
+    """Set-based maintenance of denormalized counter columns.
+
+    Subclasses list their counters in `counter_sources`, mapping each counter
+    column name to a correlated subquery that computes its true value.
+    """
+
+    @classmethod
+    def adjust_counts(cls, criterion, **deltas):
+        """Add `deltas` (counter name -> amount) to the counters of every row
+        matching `criterion`, in a single UPDATE."""
+
+        values = {
+            getattr(cls, name): getattr(cls, name) + amount
+            for name, amount in deltas.items()
+        }
+
+        cls.query.filter(criterion).update(values, synchronize_session=False)
 
-class User(db.Model):
+    @classmethod
+    def reconcile_counts(cls, batch_size=1000):
+        """Recompute every counter from the underlying tables, fixing any
+        row that has drifted.
+
+        Rows are processed in id ranges of `batch_size`, committing after each
+        range. Yields the number of rows repaired in each range.
+        """
+
+        sources = {
+            getattr(cls, name): source
+            for name, source in cls.counter_sources().items()
+        }
+        drifted = or_(*(counter != source for counter, source in sources.items()))
+
+        max_id = db.session.query(func.max(cls.id)).scalar() or 0
+
+        for start in range(1, max_id + 1, batch_size):
+            repaired = (cls
+                        .query
+                        .filter(cls.id >= start,
+                                cls.id < start + batch_size,
+                                drifted)
+                        .update(sources, synchronize_session=False))
+            db.session.commit()
+
+            yield repaired
+
+
+class User(CounterMixin, db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
@@ -73,6 +186,39 @@ class User(db.Model):
         nullable=False,
     )
 
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # set when a large account is deleted, until `purge` has removed it
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
 
     followers = db.relationship(
@@ -93,21 +239,285 @@ class User(db.Model):
         "Message", secondary="likes", backref="users_like"
     )
 
+    __table_args__ = (
+        # substring search: trigram index serves ILIKE '%term%'
+        db.Index(
+            'ix_users_username_trgm',
+            username,
+            postgresql_using='gin',
+            postgresql_ops={'username': 'gin_trgm_ops'},
+        ),
+        # typeahead: btree range scan for lower(username) LIKE 'term%'
+        db.Index(
+            'ix_users_username_lower_prefix',
+            func.lower(username).label('username_lower'),
+            postgresql_ops={'username_lower': 'text_pattern_ops'},
+        ),
+    )
+
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def to_row(self):
+        """This user's column values as a plain dict, suitable for caching
+        between requests."""
+
+        return {
+            attr.key: getattr(self, attr.key)
+            for attr in self.__mapper__.column_attrs
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        """Rebuild a user from `to_row` output and attach it to the session
+        without querying the database."""
+
+        user = cls(**row)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @classmethod
+    def counter_sources(cls):
+        """The true value of each counter column, per user."""
+
+        return {
+            'messages_count': (select(func.count())
+                               .where(Message.user_id == cls.id)
+                               .scalar_subquery()),
+            'following_count': (select(func.count())
+                                .where(Follows.user_following_id == cls.id)
+                                .scalar_subquery()),
+            'followers_count': (select(func.count())
+                                .where(Follows.user_being_followed_id == cls.id)
+                                .scalar_subquery()),
+            'likes_count': (select(func.count())
+                            .where(Like.user_id == cls.id)
+                            .scalar_subquery()),
+        }
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return bool(self.following_ids_among([other_user.id]))
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` is this user following? Returns a set of ids,
+        found with a single primary-key lookup on follows."""
+
+        if not user_ids:
+            return set()
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id,
+                            Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in followed}
+
+    def release_counts(self):
+        """Take this user's follows and likes, and the likes on their
+        messages, out of everyone else's counters ahead of deleting them."""
+
+        User.adjust_counts(
+            User.id.in_(select(Follows.user_following_id)
+                        .where(Follows.user_being_followed_id == self.id)),
+            following_count=-1)
+
+        User.adjust_counts(
+            User.id.in_(select(Follows.user_being_followed_id)
+                        .where(Follows.user_following_id == self.id)),
+            followers_count=-1)
+
+        Message.adjust_counts(
+            Message.id.in_(select(Like.message_id)
+                           .where(Like.user_id == self.id)),
+            likes_count=-1)
+
+        likes_on_own_messages = (select(Like.user_id)
+                                 .join(Message, Message.id == Like.message_id)
+                                 .where(Message.user_id == self.id))
+        likes_given_to_self = (select(func.count())
+                               .select_from(Like)
+                               .join(Message, Message.id == Like.message_id)
+                               .where(Message.user_id == self.id,
+                                      Like.user_id == User.id)
+                               .scalar_subquery())
+
+        (User
+         .query
+         .filter(User.id.in_(likes_on_own_messages))
+         .update({User.likes_count: User.likes_count - likes_given_to_self},
+                 synchronize_session=False))
+
+    @classmethod
+    def get_active_or_404(cls, user_id, *options):
+        """The user with `user_id`, or a 404 if there is none or they have
+        deleted their account. `options` are loader options for the query."""
+
+        user = cls.query.options(*options).get_or_404(user_id)
+        if user.deleted_at is not None:
+            abort(404)
+        return user
+
+    def deletion_size(self):
+        """Roughly how many rows deleting this user removes, from their
+        counters: their messages (and the timeline entries delivering them),
+        likes and follows."""
+
+        return (self.messages_count * (self.followers_count + 1)
+                + self.likes_count
+                + self.following_count
+                + self.followers_count)
+
+    def delete_account(self):
+        """Delete this user with a single statement; the foreign keys
+        cascade to their messages, likes, follows and timeline entries."""
+
+        self.release_counts()
+        User.query.filter_by(id=self.id).delete(synchronize_session=False)
+
+    def mark_deleted(self):
+        """Hide this user straight away, leaving the rows to `purge`."""
+
+        self.deleted_at = datetime.utcnow()
+
+    @classmethod
+    def purge(cls, user_id, batch_size=1000):
+        """Delete a user marked deleted, `batch_size` rows at a time.
+
+        Their messages come off other timelines first, then go with their
+        likes and follows, each batch refunding the counters it affects and
+        committing. Yields (step, rows deleted) after each batch.
+        """
+
+        own_messages = select(Message.id).where(Message.user_id == user_id)
+
+        steps = [
+            ('timeline entries', TimelineEntry, None,
+             select(TimelineEntry.user_id, TimelineEntry.message_id)
+             .where(TimelineEntry.message_id.in_(own_messages))),
+            ('timeline entries', TimelineEntry, None,
+             select(TimelineEntry.user_id, TimelineEntry.message_id)
+             .where(TimelineEntry.user_id == user_id)),
+            ('likes received', Like, (Like.user_id, User.likes_count),
+             select(Like.user_id, Like.message_id)
+             .where(Like.message_id.in_(own_messages))),
+            ('messages', Message, None,
+             select(Message.id).where(Message.user_id == user_id)),
+            ('likes', Like, (Like.message_id, Message.likes_count),
+             select(Like.user_id, Like.message_id)
+             .where(Like.user_id == user_id)),
+            ('following', Follows,
+             (Follows.user_being_followed_id, User.followers_count),
+             select(Follows.user_being_followed_id, Follows.user_following_id)
+             .where(Follows.user_following_id == user_id)),
+            ('followers', Follows,
+             (Follows.user_following_id, User.following_count),
+             select(Follows.user_being_followed_id, Follows.user_following_id)
+             .where(Follows.user_being_followed_id == user_id)),
+        ]
+
+        for step, model, refund, rows in steps:
+            while True:
+                deleted = _delete_batch(model, rows.limit(batch_size), refund)
+                db.session.commit()
+                if not deleted:
+                    break
+                yield step, deleted
+
+        cls.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+        yield 'user', 1
+
+    @classmethod
+    def search(cls, term):
+        """Query users whose username contains `term` (case-insensitively),
+        best matches first.
+
+        An exact match ranks first, then usernames starting with `term`, then
+        the rest by trigram similarity. Terms too short for the trigram index
+        only match username prefixes, read in order off the prefix index (an
+        exact match sorts before any longer name it prefixes).
+        """
+
+        lowered = func.lower(cls.username)
+        term = term.lower()
+        prefix = f"{escape_like(term)}%"
+
+        if len(term) < MIN_TRIGRAM_TERM:
+            return (cls
+                    .query
+                    .filter(lowered.like(prefix), cls.deleted_at.is_(None))
+                    .order_by(pattern_order(lowered), cls.id))
+
+        rank = case(
+            (lowered == term, 0),
+            (lowered.like(prefix), 1),
+            else_=2,
+        )
+
+        return (cls
+                .query
+                .filter(cls.username.ilike(f"%{escape_like(term)}%"),
+                        cls.deleted_at.is_(None))
+                .order_by(rank,
+                          func.similarity(cls.username, term).desc(),
+                          lowered,
+                          cls.id))
+
+    @classmethod
+    def typeahead(cls, term, limit=8):
+        """Query (id, username, image_url) of the first `limit` users whose
+        username starts with `term`, case-insensitively."""
+
+        lowered = func.lower(cls.username)
+
+        return (db.session
+                .query(cls.id, cls.username, cls.image_url)
+                .filter(lowered.like(f"{escape_like(term.lower())}%"),
+                        cls.deleted_at.is_(None))
+                .order_by(pattern_order(lowered))
+                .limit(limit))
+
+    @classmethod
+    def followers_of(cls, user_id):
+        """Query the users following `user_id`."""
+
+        return (cls
+                .query
+                .join(Follows, Follows.user_following_id == cls.id)
+                .filter(Follows.user_being_followed_id == user_id,
+                        cls.deleted_at.is_(None)))
+
+    @classmethod
+    def followed_by(cls, user_id):
+        """Query the users `user_id` is following."""
+
+        return (cls
+                .query
+                .join(Follows, Follows.user_being_followed_id == cls.id)
+                .filter(Follows.user_following_id == user_id,
+                        cls.deleted_at.is_(None)))
+
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set of ids,
+        found with a single query."""
+
+        if not message_ids:
+            return set()
+
+        liked = (db.session
+                 .query(Like.message_id)
+                 .filter(Like.user_id == self.id,
+                         Like.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in liked}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -116,7 +526,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -137,19 +547,32 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made at a lower cost than the current BCRYPT_LOG_ROUNDS is
+        replaced with a fresh one; the caller commits the change.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
-class Message(db.Model):
+# the trigram index on users.username needs pg_trgm
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+
+class Message(CounterMixin, db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
@@ -176,12 +599,28 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
+
+    __table_args__ = (
+        # a user's messages, newest first: profile pages, and copying them
+        # into timelines
+        db.Index(
+            'ix_messages_user_id_timestamp',
+            'user_id', 'timestamp', 'id',
+        ),
+    )
     
     def is_liked_by(self, user):
         """check whether the message is liked by a user. Return a boolean value..."""
 
-        return user.id in {user.id for user in self.users_like} # O(l*n) > O(l+n)
+        return bool(user.liked_message_ids([self.id]))
         
     def serialize(self):
         """returns the instance as a python dictionary"""
@@ -193,6 +632,49 @@ class Message(db.Model):
             "users_like" : [user.id for user in self.users_like]
         }
 
+    def release_counts(self):
+        """Take this message out of its author's and its likers' counters
+        ahead of deleting it."""
+
+        User.adjust_counts(User.id == self.user_id, messages_count=-1)
+        User.adjust_counts(
+            User.id.in_(select(Like.user_id).where(Like.message_id == self.id)),
+            likes_count=-1)
+
+    @classmethod
+    def counter_sources(cls):
+        """The true value of each counter column, per message."""
+
+        return {
+            'likes_count': (select(func.count())
+                            .where(Like.message_id == cls.id)
+                            .scalar_subquery()),
+        }
+
+    @classmethod
+    def liked_by(cls, user_id):
+        """Query the messages `user_id` has liked, newest first."""
+
+        return (cls
+                .query
+                .join(Like, Like.message_id == cls.id)
+                .join(cls.user)
+                .filter(Like.user_id == user_id, User.deleted_at.is_(None))
+                .order_by(cls.timestamp.desc(), cls.id.desc()))
+
+    @classmethod
+    def home_timeline(cls, user_id):
+        """Query the messages on the home timeline of `user_id`, newest first."""
+
+        return (cls
+                .query
+                .join(TimelineEntry, TimelineEntry.message_id == cls.id)
+                .join(cls.user)
+                .filter(TimelineEntry.user_id == user_id,
+                        User.deleted_at.is_(None))
+                .order_by(TimelineEntry.timestamp.desc(),
+                          TimelineEntry.message_id.desc()))
+
 
 class Like(db.Model):
     """Like association between users and messages."""
@@ -211,7 +693,307 @@ class Like(db.Model):
         primary_key=True
     )
 
-    
+    # the primary key serves a user's likes; this serves a message's likers,
+    # and cascading message deletes
+    __table_args__ = (
+        db.Index(
+            'ix_likes_message_id',
+            'message_id', 'user_id',
+        ),
+    )
+
+    @classmethod
+    def like(cls, user_id, message_id):
+        """Have `user_id` like `message_id`, unless they already do.
+
+        Returns the message's like count afterwards, or None if there is no
+        such message or its author's account is deleted. See `apply` for how
+        this stays a single statement.
+        """
+
+        author_active = Message.user.has(User.deleted_at.is_(None))
+
+        inserted = (pg_insert(cls)
+                    .from_select(
+                        ['user_id', 'message_id'],
+                        select(literal(user_id), Message.id)
+                        .where(Message.id == message_id, author_active))
+                    .on_conflict_do_nothing()
+                    .returning(cls.user_id))
+
+        return cls.apply(inserted, message_id, 1, author_active)
+
+    @classmethod
+    def unlike(cls, user_id, message_id):
+        """Have `user_id` stop liking `message_id`, if they do.
+
+        Returns the message's like count afterwards, or None if there is no
+        such message.
+        """
+
+        deleted = (delete(cls)
+                   .where(cls.user_id == user_id, cls.message_id == message_id)
+                   .returning(cls.user_id))
+
+        return cls.apply(deleted, message_id, -1)
+
+    @classmethod
+    def apply(cls, change, message_id, step, *message_filters):
+        """Run `change` (an INSERT or DELETE on likes, returning the user_id
+        of any row it touched) and move the liker's and the message's like
+        counters by `step` for each touched row, all in one round trip.
+
+        The change runs as a data-modifying CTE feeding both counter updates,
+        so liking twice, or two clicks racing, can't double count or collide.
+        Returns the message's new like count, or None if it doesn't exist
+        or doesn't pass `message_filters`. A copy of the message already in
+        the session keeps its old count until the session commits.
+        """
+
+        changed = change.cte('changed')
+
+        bumped_user = (update(User)
+                       .where(User.id.in_(select(changed.c.user_id)))
+                       .values(likes_count=User.likes_count + step)
+                       .returning(User.id)
+                       .cte('bumped_user'))
+
+        changed_count = select(func.count()).select_from(changed).scalar_subquery()
+
+        bumped_message = (update(Message)
+                          .where(Message.id == message_id, *message_filters)
+                          .values(likes_count=Message.likes_count
+                                  + step * changed_count)
+                          .returning(Message.likes_count)
+                          .add_cte(bumped_user)
+                          .execution_options(synchronize_session=False))
+
+        return db.session.execute(bumped_message).scalar()
+
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline.
+
+    Entries are written when a message is posted (one for the author and one
+    for each follower), so the home page reads a single user's entries in
+    timestamp order instead of sorting every followed user's messages.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    # copied from the message so the timeline is read straight off the index
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_id_timestamp',
+            'user_id', 'timestamp', 'message_id',
+        ),
+        # deleting a message cascades to its entries by message_id
+        db.Index(
+            'ix_timeline_entries_message_id',
+            'message_id',
+        ),
+    )
+
+    @classmethod
+    def fan_out(cls, message):
+        """Deliver a newly posted (flushed) message to the timelines of its
+        author and everyone following the author."""
+
+        # the author is added below, even if they follow themself
+        followers = select(
+            Follows.user_following_id,
+            literal(message.id),
+            literal(message.timestamp),
+        ).where(Follows.user_being_followed_id == message.user_id,
+                Follows.user_following_id != message.user_id)
+
+        author = select(
+            literal(message.user_id),
+            literal(message.id),
+            literal(message.timestamp),
+        )
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'timestamp'],
+                union_all(followers, author),
+            )
+        )
+
+    @classmethod
+    def add_followed(cls, user_id, followed_id, limit=100):
+        """Copy the `limit` most recent messages of `followed_id` into the
+        timeline of `user_id`, who has just followed them."""
+
+        # a user's own messages are on their timeline already
+        if user_id == followed_id:
+            return
+
+        recent = (
+            select(literal(user_id), Message.id, Message.timestamp)
+            .where(Message.user_id == followed_id)
+            .order_by(Message.timestamp.desc())
+            .limit(limit)
+        )
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'timestamp'],
+                recent,
+            )
+        )
+
+    @classmethod
+    def remove_followed(cls, user_id, followed_id):
+        """Drop the messages of `followed_id` from the timeline of `user_id`,
+        who has just stopped following them."""
+
+        # a user's own messages stay on their timeline
+        if user_id == followed_id:
+            return
+
+        followed_messages = select(Message.id).where(
+            Message.user_id == followed_id)
+
+        cls.query.filter(
+            cls.user_id == user_id,
+            cls.message_id.in_(followed_messages),
+        ).delete(synchronize_session=False)
+
+    @classmethod
+    def rebuild(cls, user_ids=None, limit=100, batch_size=1000):
+        """Rebuild timelines from the messages and follows tables: every
+        timeline, or only those of `user_ids`. As when following someone,
+        a timeline gets the `limit` most recent messages of each user
+        followed.
+
+        Users are processed `batch_size` at a time, each batch's timelines
+        deleted and written again in one transaction, so a timeline is never
+        seen empty, and a large rebuild doesn't hold one huge transaction.
+        Entries fanned out while the rebuild runs are kept. Yields the
+        number of entries written for each batch.
+        """
+
+        if user_ids is None:
+            max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+            batches = [
+                lambda column, start=start: column.between(
+                    start, start + batch_size - 1)
+                for start in range(1, max_id + 1, batch_size)
+            ]
+        else:
+            user_ids = sorted(user_ids)
+            batches = [
+                lambda column, ids=user_ids[i:i + batch_size]: column.in_(ids)
+                for i in range(0, len(user_ids), batch_size)
+            ]
+
+        for in_batch in batches:
+            cls.query.filter(in_batch(cls.user_id)).delete(
+                synchronize_session=False)
+
+            recent = (
+                select(Message.id, Message.timestamp)
+                .where(Message.user_id == Follows.user_being_followed_id)
+                .order_by(Message.timestamp.desc())
+                .limit(limit)
+                .lateral('recent')
+            )
+
+            followed = (
+                select(Follows.user_following_id, recent.c.id,
+                       recent.c.timestamp)
+                .select_from(Follows)
+                .join(recent, true())
+                .where(in_batch(Follows.user_following_id),
+                       Follows.user_following_id
+                       != Follows.user_being_followed_id)
+            )
+
+            own = (
+                select(Message.user_id, Message.id, Message.timestamp)
+                .where(in_batch(Message.user_id))
+            )
+
+            # a message posted since the delete is fanned out to this batch
+            # too, and already there
+            result = db.session.execute(
+                pg_insert(cls).from_select(
+                    ['user_id', 'message_id', 'timestamp'],
+                    union_all(followed, own),
+                ).on_conflict_do_nothing()
+            )
+            db.session.commit()
+
+            yield result.rowcount
+
+
+def _delete_batch(model, rows, refund=None):
+    """Delete the rows of `model` whose primary keys `rows` selects, and
+    return how many there were.
+
+    `refund` is (column, counter): one is taken off `counter` of the row that
+    each deleted row's `column` refers to, in the same statement.
+    """
+
+    keys = model.__table__.primary_key.columns
+    deleted = (delete(model)
+               .where(tuple_(*keys).in_(rows))
+               .execution_options(synchronize_session=False))
+
+    if refund is None:
+        return db.session.execute(deleted).rowcount
+
+    column, counter = refund
+    target = counter.class_
+
+    deleted = deleted.returning(column).cte('deleted')
+    per_row = (select(deleted.c[column.key], func.count().label('rows'))
+               .group_by(deleted.c[column.key])
+               .subquery())
+    refunded = (update(target)
+                .where(target.id == per_row.c[column.key])
+                .values({counter: counter - per_row.c.rows})
+                .returning(per_row.c.rows)
+                .execution_options(synchronize_session=False))
+
+    # every deleted row refers to a row of `target`, so the refunds add up
+    # to the rows deleted
+    return sum(rows for (rows,) in db.session.execute(refunded))
+
+
+##############################################################################
+# Loader options for listing pages: load what each template shows up front,
+# and only the columns it shows, so a page's query count doesn't grow with
+# the number of rows on it.
+
+# a message's author, joined into the message query
+with_author = joinedload(Message.user).load_only(
+    User.id, User.username, User.image_url, User.deleted_at)
+
+# the columns of a user card (directory, followers and following pages)
+user_card_columns = (
+    User.id, User.username, User.image_url, User.header_image_url, User.bio)
+
+# ...as a loader option, for listings that need User entities
+user_card = load_only(*user_card_columns)
 
 
 def connect_db(app):
@@ -0,0 +1,61 @@
+"""Keyset (cursor) pagination for newest-first listings."""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from werkzeug.exceptions import BadRequest
+
+PER_PAGE = 100
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_cursor(timestamp, id):
+    """Encode the (timestamp, id) key of the last row on a page as an opaque,
+    URL-safe cursor string."""
+
+    raw = f"{timestamp.isoformat()}|{id}".encode('UTF-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor from `encode_cursor` back into a (timestamp, id) pair.
+
+    Raises BadRequest if the cursor is malformed.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, id = urlsafe_b64decode(padded).decode('UTF-8').split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def paginate(query, timestamp_col, id_col, cursor=None, per_page=PER_PAGE,
+             key=lambda row: (row.timestamp, row.id)):
+    """Return one Page of `query`, newest first, ordered by
+    (`timestamp_col`, `id_col`).
+
+    Rows strictly older than `cursor` are returned, so every page is an index
+    range scan no matter how deep it is. `key` pulls the (timestamp, id) pair
+    out of a result row to build the cursor for the next page.
+    """
+
+    if cursor:
+        query = query.filter(
+            tuple_(timestamp_col, id_col) < tuple_(*decode_cursor(cursor)))
+
+    rows = (query
+            .order_by(None)
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return Page(rows, encode_cursor(*key(rows[-1])))
+
+    return Page(rows, None)
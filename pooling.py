@@ -0,0 +1,94 @@
+"""Database connection pool settings, and metrics for sizing the pool.
+
+Each web worker process has its own pool, so the connections the app can
+open are (DB_POOL_SIZE + DB_MAX_OVERFLOW) times the number of workers; keep
+that under the database's connection limit.
+
+Behind PgBouncer in transaction pooling mode, PgBouncer does the pooling and
+may hand each transaction a different server connection, so nothing may
+depend on state kept in a server session between transactions. The app
+doesn't: psycopg2 prepares no statements on the server, and the pool rolls
+back each connection as it is returned. In that mode (DB_PGBOUNCER) the
+pool keeps only PGBOUNCER_IDLE connections to PgBouncer open between
+checkouts, since an idle one holds no server connection and opening one is
+cheap; the rest of DB_POOL_SIZE becomes overflow, opened when needed and
+closed on return. The pool and its metrics are the same in both modes.
+"""
+
+from time import perf_counter
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from metrics import registry
+
+# connections kept open to PgBouncer between checkouts
+PGBOUNCER_IDLE = 2
+
+checkout_wait = registry.histogram(
+    'warbler_db_pool_checkout_wait_seconds',
+    "Time spent waiting for a connection from the pool.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+checkout_timeouts = registry.counter(
+    'warbler_db_pool_checkout_timeouts_total',
+    "Checkouts that gave up after DB_POOL_TIMEOUT seconds.")
+checked_out = registry.gauge(
+    'warbler_db_pool_checked_out',
+    "Connections currently checked out of the pool.")
+capacity = registry.gauge(
+    'warbler_db_pool_capacity',
+    "Most connections the pool will open: pool size plus overflow.")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """SQLAlchemy's default pool, recording how long checkouts wait and how
+    many connections are in use. The pool's logging name labels its
+    metrics."""
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super().__init__(creator, pool_size=pool_size,
+                         max_overflow=max_overflow, **kw)
+        capacity.set(pool_size + max(max_overflow, 0), pool=self._name())
+
+    def _name(self):
+        return self.logging_name or 'primary'
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc(pool=self._name())
+            raise
+        finally:
+            checkout_wait.observe(perf_counter() - start, pool=self._name())
+
+        checked_out.set(self.checkedout(), pool=self._name())
+        return connection
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        checked_out.set(self.checkedout(), pool=self._name())
+
+
+def engine_options(size=5, max_overflow=10, timeout=30, recycle=-1,
+                   pre_ping=False, pgbouncer=False):
+    """SQLALCHEMY_ENGINE_OPTIONS for these pool settings.
+
+    `recycle` replaces connections older than that many seconds (-1: never);
+    `pre_ping` tests each connection as it is checked out, so one the
+    server has closed is replaced rather than failing the request.
+    """
+
+    if pgbouncer:
+        idle = min(size, PGBOUNCER_IDLE)
+        size, max_overflow = idle, max_overflow + size - idle
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': size,
+        'max_overflow': max_overflow,
+        'pool_timeout': timeout,
+        'pool_recycle': recycle,
+        'pool_pre_ping': pre_ping,
+    }
@@ -0,0 +1,224 @@
+"""Read replicas: read-only requests read from a replica, everything else
+goes to the primary.
+
+GET, HEAD and OPTIONS requests send their queries to one of the healthy
+replicas listed in SQLALCHEMY_REPLICA_URLS, chosen once per request. Others
+(posting, liking, following...) use the primary only, and pin their user's
+session to it for REPLICA_PIN_SECONDS afterwards, so the pages they go on to
+read show their own change even if the replicas haven't caught up yet.
+
+Each worker checks its replicas' lag every REPLICA_CHECK_INTERVAL seconds,
+in a background thread, so no request waits on a check; requests use the
+last results. A replica more than REPLICA_MAX_LAG seconds behind, that isn't
+streaming WAL from the primary, or that can't be reached, is left out until a
+later check finds it healthy again, as is one not checked yet. With no
+healthy replica, reads go to the primary.
+
+Replica connections give up connecting after REPLICA_CONNECT_TIMEOUT seconds
+and cancel statements running longer than REPLICA_STATEMENT_TIMEOUT, so an
+unresponsive replica can't hold up a request, or a check, for long.
+"""
+
+import random
+from threading import Lock, Thread
+from time import monotonic, time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, exc, orm, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+from metrics import registry
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# session key: read from the primary until this time
+PRIMARY_UNTIL_KEY = 'primary_until'
+
+# seconds the replica is behind; 0 when it has replayed everything received,
+# since an idle primary sends nothing new to replay. NULL when its WAL
+# receiver isn't streaming: then nothing new is received either, so the
+# receive and replay positions match however far behind it is. Without
+# pg_read_all_stats, pg_stat_wal_receiver shows only the receiver's pid; a
+# running receiver is then taken to be streaming.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                         WHERE COALESCE(status, 'streaming') = 'streaming')
+            THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+replica_lag = registry.gauge(
+    'warbler_replica_lag_seconds',
+    "How far each read replica was behind the primary at its last check.")
+replica_healthy = registry.gauge(
+    'warbler_replica_healthy',
+    "1 if a read replica is in rotation, 0 if it was dropped from it.")
+
+
+def _start_thread(target):
+    Thread(target=target, name='replica-check', daemon=True).start()
+
+
+class Replica:
+    """One replica's engine and health."""
+
+    def __init__(self, url, engine_options=None, connect_timeout=2,
+                 statement_timeout=5):
+        url = make_url(url)
+        self.name = f"{url.host or 'localhost'}:{url.port or 5432}"
+
+        options = dict(engine_options or {})
+        options['connect_args'] = {
+            **options.get('connect_args', {}),
+            'connect_timeout': connect_timeout,
+            'options': f"-c statement_timeout={int(statement_timeout * 1000)}",
+        }
+        self.engine = create_engine(
+            url, **options, pool_logging_name=self.name)
+
+        # not read from until a check finds it healthy
+        self.healthy = False
+        self.lag = None
+
+        event.listen(self.engine, 'handle_error', self._on_error)
+
+    def check(self, max_lag):
+        """Measure the lag, and whether it is small enough to read from.
+        The lag is None if it can't be measured."""
+
+        try:
+            with self.engine.connect() as connection:
+                lag = connection.execute(LAG_QUERY).scalar()
+        except exc.DBAPIError:
+            lag = None
+
+        self.lag = float(lag) if lag is not None else None
+
+        self.healthy = self.lag is not None and self.lag <= max_lag
+
+        replica_lag.set(self.lag if self.lag is not None else -1,
+                        replica=self.name)
+        replica_healthy.set(int(self.healthy), replica=self.name)
+
+    def _on_error(self, exception_context):
+        # a lost connection takes the replica out until the next check
+        if exception_context.is_disconnect:
+            self.healthy = False
+            replica_healthy.set(0, replica=self.name)
+
+
+class ReplicaSet:
+    """The replicas reads may go to, checked every `check_interval`
+    seconds.
+
+    Checks are run by `spawn`, which is given a function to call and by
+    default calls it in a new daemon thread.
+    """
+
+    def __init__(self, replicas, max_lag=5, check_interval=10,
+                 clock=monotonic, spawn=_start_thread):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.clock = clock
+        self.spawn = spawn
+        self._next_check = 0
+        self._lock = Lock()
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check(self.max_lag)
+
+    def _check_and_release(self):
+        try:
+            self.check()
+        finally:
+            self._lock.release()
+
+    def choose(self):
+        """The engine of a healthy replica, or None if there isn't one."""
+
+        # one check at a time, off the request; requests go on with the last
+        # results meanwhile
+        if self.clock() >= self._next_check and self._lock.acquire(False):
+            self._next_check = self.clock() + self.check_interval
+            try:
+                self.spawn(self._check_and_release)
+            except Exception:
+                self._lock.release()
+                raise
+
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return random.choice(healthy).engine
+
+
+class RoutingSession(SignallingSession):
+    """Flask-SQLAlchemy's session, reading from the request's replica when
+    it has one. Flushes and INSERT/UPDATE/DELETE statements always go to
+    the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if (not self._flushing
+                and not isinstance(clause, UpdateBase)
+                and has_request_context()):
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with sessions that can read from replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replicas:
+    """Route an app's read-only requests to its read replicas."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config.get('SQLALCHEMY_REPLICA_URLS') or []
+        engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+
+        self.pin_seconds = app.config.get('REPLICA_PIN_SECONDS', 10)
+        replicas = [
+            Replica(url, engine_options,
+                    connect_timeout=app.config.get('REPLICA_CONNECT_TIMEOUT', 2),
+                    statement_timeout=app.config.get(
+                        'REPLICA_STATEMENT_TIMEOUT', 5))
+            for url in urls
+        ]
+        self.replica_set = ReplicaSet(
+            replicas,
+            max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+            check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 10),
+        )
+
+        if urls:
+            app.before_request(self._choose_replica)
+            app.after_request(self._pin_after_write)
+
+    def _choose_replica(self):
+        if (request.method in SAFE_METHODS
+                and session.get(PRIMARY_UNTIL_KEY, 0) <= time()):
+            g.db_replica = self.replica_set.choose()
+
+    def _pin_after_write(self, response):
+        if request.method not in SAFE_METHODS:
+            session[PRIMARY_UNTIL_KEY] = time() + self.pin_seconds
+        return response
@@ -0,0 +1,38 @@
+"""Lazily evaluated attributes on Flask's `g`."""
+
+from flask.ctx import _AppCtxGlobals
+
+
+class LazyAppGlobals(_AppCtxGlobals):
+    """Flask's `g`, extended so some attributes are computed on first use.
+
+    A loader registered with `LazyAppGlobals.lazy(name)` runs the first time
+    `g.<name>` is read during a request (from a view or a template), and its
+    result is stored on `g` for the rest of the request. Requests that never
+    read the attribute never pay for it.
+
+    Install with `app.app_ctx_globals_class = LazyAppGlobals`.
+    """
+
+    loaders = {}
+
+    @classmethod
+    def lazy(cls, name):
+        """Decorator registering a zero-argument function as the loader for
+        `g.<name>`."""
+
+        def register(loader):
+            cls.loaders[name] = loader
+            return loader
+
+        return register
+
+    def __getattr__(self, name):
+        try:
+            loader = self.loaders[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+        value = loader()
+        setattr(self, name, value)
+        return value
@@ -0,0 +1,140 @@
+"""The database schema: creating it, and checking it against the models.
+
+Changes to the schema are Alembic migrations in migrations/versions, run with
+`flask db upgrade`; they build indexes on existing tables with
+`build_index_concurrently`, which doesn't block writes. `index_drift`
+compares the indexes the models declare with those in the database, so an
+index added to a model without a migration, or a concurrent build that
+failed, doesn't go unnoticed.
+"""
+
+from flask_migrate import stamp
+from sqlalchemy import Column, text
+
+from models import db
+
+# secondary indexes in the database: those not backing a primary key or
+# unique constraint
+DATABASE_INDEXES = text("""
+    SELECT index_class.relname AS name,
+           table_class.relname AS table_name,
+           pg_index.indisvalid AS valid,
+           pg_get_indexdef(pg_index.indexrelid) AS definition
+    FROM pg_index
+    JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+    JOIN pg_class table_class ON table_class.oid = pg_index.indrelid
+    JOIN pg_namespace ON pg_namespace.oid = table_class.relnamespace
+    WHERE pg_namespace.nspname = current_schema()
+      AND table_class.relname = ANY(:tables)
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                      WHERE pg_constraint.conindid = pg_index.indexrelid)
+""")
+
+
+INDEX_VALID = text("""
+    SELECT pg_index.indisvalid
+    FROM pg_index
+    JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+    JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
+    WHERE pg_namespace.nspname = current_schema()
+      AND pg_class.relname = :name
+""")
+
+
+def reset():
+    """Drop every table and create the schema afresh from the models,
+    recording it as up to date with the latest migration. Needs an app
+    context."""
+
+    db.drop_all()
+    db.create_all()
+    stamp()
+
+
+def build_index_concurrently(op, name, table, columns, **kw):
+    """For migrations: build an index with CREATE INDEX CONCURRENTLY, so
+    writes to `table` carry on while it builds. Call it inside
+    `op.get_context().autocommit_block()`.
+
+    A valid index named `name` is left alone. An invalid one, left behind by
+    a concurrent build that failed part-way, is dropped and built again.
+    """
+
+    valid = op.get_bind().execute(INDEX_VALID, {'name': name}).scalar()
+
+    if valid:
+        return
+    if valid is not None:
+        op.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+    op.create_index(name, table, columns, postgresql_concurrently=True, **kw)
+
+
+def _model_columns(index):
+    """The column names of `index`, or None for an expression index."""
+
+    if not all(isinstance(expression, Column) for expression in index.expressions):
+        return None
+    return [column.name for column in index.expressions]
+
+
+def _database_columns(definition):
+    """The column names in a pg_get_indexdef() definition, or None for an
+    expression index."""
+
+    columns = definition[definition.index('(', definition.index(' ON ')) + 1:
+                         definition.rindex(')')]
+    names = []
+
+    for column in columns.split(', '):
+        name = column.split(' ')[0].strip('"')
+        if not name.isidentifier():
+            return None
+        names.append(name)
+
+    return names
+
+
+def index_drift(metadata=None, connection=None):
+    """How the database's indexes differ from the models'. Returns a list of
+    problems, each a line of text; empty if they match."""
+
+    metadata = metadata or db.metadata
+    connection = connection or db.session
+
+    expected = {index.name: index
+                for table in metadata.sorted_tables
+                for index in table.indexes}
+    found = {row.name: row
+             for row in connection.execute(
+                 DATABASE_INDEXES, {'tables': list(metadata.tables)})}
+
+    problems = []
+
+    for name, index in sorted(expected.items()):
+        row = found.get(name)
+
+        if row is None:
+            problems.append(f"missing: {name} on {index.table.name}")
+        elif not row.valid:
+            problems.append(
+                f"invalid: {name} (a failed concurrent build; drop it and "
+                f"build it again)")
+        elif row.table_name != index.table.name:
+            problems.append(
+                f"wrong table: {name} is on {row.table_name}, "
+                f"not {index.table.name}")
+        else:
+            model_columns = _model_columns(index)
+            database_columns = _database_columns(row.definition)
+            if model_columns is not None and model_columns != database_columns:
+                problems.append(
+                    f"different columns: {name} is on "
+                    f"({', '.join(database_columns or ['<expression>'])}), "
+                    f"not ({', '.join(model_columns)})")
+
+    for name, row in sorted(found.items()):
+        if name not in expected:
+            problems.append(f"unexpected: {name} on {row.table_name}")
+
+    return problems
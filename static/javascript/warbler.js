@@ -6,16 +6,18 @@ async function likeClickHandler(evt){
     evt.preventDefault();
     let messageId = $(evt.target).attr("id");
     let csrfToken = $(evt.target).find("input").val()
+    let $icon = $(evt.target).find("i");
     // console.log($(evt.target))
     const response = await axios({
       url: `${BASE_URL}/messages/${messageId}/like`,
-      method: "POST",
+      method: $icon.hasClass("fas") ? "DELETE" : "PUT",
       data: {
         "csrf_token": csrfToken
       }
     });
 
-    $(evt.target).find("i").toggleClass("fas far");
+    $icon.toggleClass("fas", response.data.liked);
+    $icon.toggleClass("far", !response.data.liked);
     
 
     return false;
@@ -23,3 +25,33 @@ async function likeClickHandler(evt){
 
 
 $(".container").on("submit", ".like-btn-form", likeClickHandler);
+
+
+let typeaheadTimer;
+
+function searchTypeaheadHandler(evt){
+    clearTimeout(typeaheadTimer);
+    const term = $(evt.target).val().trim();
+
+    // wait for a pause in typing before asking for suggestions
+    typeaheadTimer = setTimeout(async function(){
+        const $suggestions = $("#search-suggestions");
+
+        if (!term) {
+            $suggestions.empty();
+            return;
+        }
+
+        const response = await axios.get("/users/typeahead", {
+            params: { q: term }
+        });
+
+        $suggestions.empty();
+        for (let user of response.data.users) {
+            $suggestions.append($("<option>").val(user.username));
+        }
+    }, 150);
+}
+
+
+$("#search").on("input", searchTypeaheadHandler);
@@ -0,0 +1,169 @@
+"""JSON API view tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api_views.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiViewTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """Two users, one following the other, and three messages."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        Like.query.delete()
+
+        self.client = app.test_client()
+
+        u = User(id=1, email="test@test.com", username="testuser",
+                 password="HASHED_PASSWORD")
+        u2 = User(id=2, email="test2@test.com", username="testuser2",
+                  password="HASHED_PASSWORD")
+        db.session.add_all([u, u2])
+        db.session.commit()
+
+        for i in range(3):
+            db.session.add(Message(id=i + 1, text=f"TestMessage{i + 1}",
+                                   timestamp=datetime(2021, 1, i + 1),
+                                   user_id=u2.id))
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.add(Like(user_id=1, message_id=3))
+        db.session.commit()
+
+        sum(TimelineEntry.rebuild())
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_login_required(self):
+        """listings behind a login on the site are 401 without one"""
+
+        response = self.client.get('/api/v1/timeline')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('error', response.get_json())
+
+    def test_timeline_pages_and_fields(self):
+        """the timeline is paginated by cursor and has only the asked for
+        fields"""
+
+        with self.client as client:
+            self.login(client)
+
+            response = client.get(
+                '/api/v1/timeline?limit=2&fields=id,liked,user')
+            body = response.get_json()
+
+            self.assertEqual(body['data'], [
+                {'id': 3, 'liked': True,
+                 'user': {'id': 2, 'username': 'testuser2',
+                          'image_url': '/static/images/default-pic.png'}},
+                {'id': 2, 'liked': False,
+                 'user': {'id': 2, 'username': 'testuser2',
+                          'image_url': '/static/images/default-pic.png'}},
+            ])
+
+            body = client.get(
+                f"/api/v1/timeline?limit=2&fields=id&before={body['next']}"
+            ).get_json()
+
+            self.assertEqual(body, {'data': [{'id': 1}], 'next': None})
+
+    def test_deleted_author_hidden(self):
+        """messages by an author whose account is deleted leave the timeline
+        and likes listings"""
+
+        User.query.get(2).mark_deleted()
+        db.session.commit()
+
+        with self.client as client:
+            self.login(client)
+
+            self.assertEqual(client.get('/api/v1/timeline').get_json(),
+                             {'data': [], 'next': None})
+            self.assertEqual(client.get('/api/v1/users/1/likes').get_json(),
+                             {'data': [], 'next': None})
+
+    def test_unknown_field(self):
+        """asking for a field that doesn't exist is a bad request"""
+
+        response = self.client.get('/api/v1/users/2/messages?fields=id,secret')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_followers(self):
+        """followers are listed with the viewer's follow state"""
+
+        with self.client as client:
+            self.login(client)
+
+            body = client.get(
+                '/api/v1/users/1/following?fields=username,followed').get_json()
+
+            self.assertEqual(body, {
+                'data': [{'username': 'testuser2', 'followed': True}],
+                'next': None})
+
+    def test_message_detail(self):
+        """a message can be fetched alone, and revalidated by ETag"""
+
+        response = self.client.get('/api/v1/messages/1?fields=text,likes_count')
+
+        self.assertEqual(response.get_json(),
+                         {'data': {'text': 'TestMessage1', 'likes_count': 0}})
+
+        response = self.client.get(
+            '/api/v1/messages/1?fields=text,likes_count',
+            headers={'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/api/v1/messages/99').status_code, 404)
+
+    def test_message_detail_loads_only_fields(self):
+        """a message alone loads only the columns of the asked for fields"""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            body = self.client.get('/api/v1/messages/1?fields=id').get_json()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(body, {'data': {'id': 1}})
+
+        selects = [statement for statement in statements
+                   if statement.startswith("SELECT")
+                   and "FROM messages" in statement]
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn("messages.text", selects[0])
+        self.assertNotIn("messages.likes_count", selects[0])
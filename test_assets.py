@@ -0,0 +1,63 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+import assets
+
+
+class BuildAssetsTestCase(TestCase):
+    """Test fingerprinting and compression of static files."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        self.static = os.path.join(tmp.name, 'static')
+        self.dist = os.path.join(self.static, 'dist')
+
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+
+        with open(os.path.join(self.static, 'images', 'bg.png'), 'wb') as f:
+            f.write(b'png')
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'w') as f:
+            f.write('body { background: url("/static/images/bg.png"); }')
+
+    def read(self, path, mode='r'):
+        with open(os.path.join(self.dist, path), mode) as f:
+            return f.read()
+
+    def test_build(self):
+        """built files are named by their content, compressed and listed in
+        the manifest, and stylesheets point at built images"""
+
+        manifest = assets.build(self.static, self.dist)
+
+        image = manifest['images/bg.png']
+        stylesheet = manifest['stylesheets/style.css']
+
+        self.assertRegex(image, r'^images/bg\.[0-9a-f]{12}\.png$')
+        self.assertTrue(assets.is_immutable(None, f"/static/dist/{image}"))
+        self.assertEqual(assets.load_manifest(self.dist), manifest)
+
+        css = self.read(stylesheet)
+        self.assertIn(f'url("/static/dist/{image}")', css)
+        self.assertEqual(
+            gzip.decompress(self.read(stylesheet + '.gz', 'rb')).decode(), css)
+
+    def test_rebuild_ignores_dist(self):
+        """building again gives the same names and doesn't fingerprint the
+        previous build"""
+
+        first = assets.build(self.static, self.dist)
+        second = assets.build(self.static, self.dist)
+
+        self.assertEqual(first, second)
@@ -0,0 +1,93 @@
+"""In-process cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from cache import FragmentCache, TTLCache
+
+
+class TTLCacheTestCase(TestCase):
+    """Test expiry and eviction of TTLCache."""
+
+    def test_get_and_set(self):
+        """a stored value can be read back until invalidated"""
+
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set(1, "one")
+
+        self.assertEqual(cache.get(1), "one")
+
+        cache.invalidate(1)
+
+        self.assertIsNone(cache.get(1))
+
+    def test_expiry(self):
+        """values are dropped once their ttl has passed"""
+
+        cache = TTLCache(maxsize=10, ttl=5)
+
+        with patch('cache.monotonic', return_value=100):
+            cache.set(1, "one")
+
+        with patch('cache.monotonic', return_value=104):
+            self.assertEqual(cache.get(1), "one")
+
+        with patch('cache.monotonic', return_value=105):
+            self.assertIsNone(cache.get(1))
+
+    def test_lru_eviction(self):
+        """the least recently used entry is evicted when the cache is full"""
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(1), "one")
+        self.assertIsNone(cache.get(2))
+
+    def test_disabled(self):
+        """a zero ttl disables caching"""
+
+        cache = TTLCache(maxsize=10, ttl=0)
+        cache.set(1, "one")
+
+        self.assertIsNone(cache.get(1))
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test versioning and byte-capped eviction of FragmentCache."""
+
+    def test_version_must_match(self):
+        """a fragment is only returned for the version it was stored at"""
+
+        cache = FragmentCache(max_bytes=100)
+        cache.set(("message", 1), ("alice",), "<li>alice</li>")
+
+        self.assertEqual(cache.get(("message", 1), ("alice",)), "<li>alice</li>")
+        self.assertIsNone(cache.get(("message", 1), ("alicia",)))
+
+    def test_evicts_to_stay_under_max_bytes(self):
+        """the least recently used fragments go once the cache is too big"""
+
+        cache = FragmentCache(max_bytes=10)
+        cache.set(1, (), "aaaa")
+        cache.set(2, (), "bbbb")
+        cache.get(1, ())
+        cache.set(3, (), "cccc")
+
+        self.assertEqual(cache.size, 8)
+        self.assertIsNone(cache.get(2, ()))
+        self.assertEqual(cache.get(1, ()), "aaaa")
+
+        cache.invalidate(1)
+
+        self.assertEqual(cache.size, 4)
+        self.assertEqual(len(cache), 1)
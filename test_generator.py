@@ -0,0 +1,127 @@
+"""CSV generator helper tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+from collections import Counter
+from datetime import datetime
+from random import Random
+from unittest import TestCase
+
+from generator.helpers import (PowerLaw, bursty_timestamps, distinct_draws,
+                               heavy_tailed_count, years_before)
+
+
+class PowerLawTestCase(TestCase):
+    """Test the skewed id distribution."""
+
+    def test_ids_in_bounds(self):
+        """every draw is an id from 1 to n, whatever the skew"""
+
+        rng = Random(1)
+
+        for n in (1, 2, 7, 1000):
+            for skew in (0.5, 1.0, 1.5):
+                dist = PowerLaw(n, skew)
+                ids = {dist.draw(rng) for _ in range(2000)}
+
+                self.assertGreaterEqual(min(ids), 1)
+                self.assertLessEqual(max(ids), n)
+
+    def test_ranks_map_to_distinct_ids(self):
+        """each rank has its own id, so every id can be drawn"""
+
+        dist = PowerLaw(1000)
+
+        self.assertEqual({dist.id_of(rank) for rank in range(1000)},
+                         set(range(1, 1001)))
+
+    def test_skewed(self):
+        """the most popular id is drawn far more often than a typical one"""
+
+        rng = Random(2)
+        dist = PowerLaw(1000, skew=1.2)
+        counts = Counter(dist.draw(rng) for _ in range(20000))
+
+        self.assertEqual(counts.most_common(1)[0][0], dist.id_of(0))
+        self.assertGreater(counts[dist.id_of(0)], 50 * counts[dist.id_of(500)])
+
+
+class DistinctDrawsTestCase(TestCase):
+    """Test drawing sets of ids."""
+
+    def test_distinct_and_excluded(self):
+        """draws are distinct ids, never the excluded one"""
+
+        rng = Random(3)
+        dist = PowerLaw(100)
+        drawn = distinct_draws(rng, dist, 30, exclude=dist.id_of(0))
+
+        self.assertEqual(len(drawn), 30)
+        self.assertNotIn(dist.id_of(0), drawn)
+        self.assertTrue(all(1 <= id <= 100 for id in drawn))
+
+    def test_gives_up_when_too_few_ids(self):
+        """asking for more ids than exist returns what there are"""
+
+        drawn = distinct_draws(Random(4), PowerLaw(5), 10, exclude=1)
+
+        self.assertLessEqual(drawn, {2, 3, 4, 5})
+
+
+class HeavyTailedCountTestCase(TestCase):
+    """Test per-user counts."""
+
+    def test_mean_holds_when_small(self):
+        """counts average out to the requested mean, even below one"""
+
+        rng = Random(6)
+
+        for mean in (0.5, 1, 3):
+            counts = [heavy_tailed_count(rng, mean, 10000)
+                      for _ in range(50000)]
+
+            self.assertAlmostEqual(sum(counts) / len(counts), mean,
+                                   delta=0.1 * mean)
+
+    def test_capped(self):
+        """no count is above the cap"""
+
+        rng = Random(7)
+
+        self.assertLessEqual(
+            max(heavy_tailed_count(rng, 50, 60) for _ in range(1000)), 60)
+
+
+class YearsBeforeTestCase(TestCase):
+    """Test moving a date back whole years."""
+
+    def test_same_day(self):
+        self.assertEqual(years_before(datetime(2021, 3, 5, 12), 2),
+                         datetime(2019, 3, 5, 12))
+
+    def test_leap_day(self):
+        """29 February goes back to the 28th in a year without one"""
+
+        self.assertEqual(years_before(datetime(2024, 2, 29), 2),
+                         datetime(2022, 2, 28))
+        self.assertEqual(years_before(datetime(2024, 2, 29), 4),
+                         datetime(2020, 2, 29))
+
+
+class BurstyTimestampsTestCase(TestCase):
+    """Test message timestamp generation."""
+
+    def test_sorted_and_in_range(self):
+        """timestamps come back in order, between start and end"""
+
+        start = datetime(2021, 1, 1)
+        end = datetime(2021, 2, 1)
+        timestamps = bursty_timestamps(Random(5), 500, start, end)
+
+        self.assertEqual(len(timestamps), 500)
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertGreaterEqual(timestamps[0], start)
+        self.assertLessEqual(timestamps[-1], end)
@@ -0,0 +1,95 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+from unittest.mock import patch
+
+from hashing import PasswordHasher, HashingBusy, calibrate, hash_cost
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing, checking and back-pressure of PasswordHasher."""
+
+    def test_hash_and_check_inline(self):
+        """with no workers, hashes are made and checked on the calling thread"""
+
+        hasher = PasswordHasher(rounds=4, workers=0)
+        hashed = hasher.hash("password")
+
+        self.assertEqual(hash_cost(hashed), 4)
+        self.assertTrue(hasher.check(hashed, "password"))
+        self.assertFalse(hasher.check(hashed, "bazinga"))
+
+    def test_hash_and_check_on_pool(self):
+        """hashes made on the pool check the same as inline ones"""
+
+        hasher = PasswordHasher(rounds=4, workers=1)
+        self.addCleanup(hasher.shutdown)
+
+        hashed = hasher.hash("password")
+
+        self.assertTrue(PasswordHasher(workers=0).check(hashed, "password"))
+        self.assertFalse(hasher.check(hashed, "bazinga"))
+
+    def test_needs_rehash(self):
+        """only hashes made at a lower cost need replacing"""
+
+        weak = PasswordHasher(rounds=4, workers=0).hash("password")
+        hasher = PasswordHasher(rounds=5, workers=0)
+
+        self.assertTrue(hasher.needs_rehash(weak))
+        self.assertFalse(hasher.needs_rehash(hasher.hash("password")))
+
+    def test_busy_when_slow_or_full(self):
+        """a hash that times out raises HashingBusy, and keeps its slot until
+        it finishes, so the next request is turned away at once"""
+
+        hasher = PasswordHasher(rounds=15, workers=1, max_pending=1,
+                                timeout=0.01)
+        self.addCleanup(hasher.shutdown)
+
+        with self.assertRaises(HashingBusy):
+            hasher.hash("password")
+
+        with self.assertRaises(HashingBusy):
+            hasher.check("$2b$04$" + "a" * 53, "password")
+
+    def test_replaces_broken_pool(self):
+        """a pool broken by a worker dying is replaced, and the hash made on
+        the new one"""
+
+        hasher = PasswordHasher(rounds=4, workers=1)
+        self.addCleanup(hasher.shutdown)
+        hashed = hasher.hash("password")
+
+        broken = hasher._executor
+        for process in list(broken._processes.values()):
+            process.kill()
+            process.join()
+
+        self.assertTrue(hasher.check(hashed, "password"))
+        self.assertIsNot(hasher._executor, broken)
+
+    def test_hashes_inline_when_pool_keeps_breaking(self):
+        """if a new pool breaks too, the hash is made inline"""
+
+        hasher = PasswordHasher(rounds=4, workers=1)
+        self.addCleanup(hasher.shutdown)
+
+        with patch.object(hasher, '_run_on', side_effect=BrokenProcessPool):
+            hashed = hasher.hash("password")
+
+        self.assertTrue(PasswordHasher(workers=0).check(hashed, "password"))
+
+    def test_calibrate(self):
+        """calibrate stops at the first cost over target"""
+
+        rounds, timings = calibrate(target_ms=0, min_rounds=4, max_rounds=6)
+
+        self.assertEqual(rounds, 4)
+        self.assertEqual(len(timings), 1)
@@ -5,13 +5,13 @@
 #    python -m unittest test_user_model.py
 
 
-from datetime import time
+from datetime import datetime, time, timedelta
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows, Like
+from models import db, User, Message, Follows, Like, TimelineEntry
 from flask_bcrypt import Bcrypt
-from sqlalchemy import exc
+from sqlalchemy import event, exc, insert
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -119,3 +119,81 @@ class UserModelTestCase(TestCase):
         
         self.assertTrue(self.m_u1.is_liked_by(self.u2))
         self.assertFalse(self.m_u1.is_liked_by(self.u))
+
+    def test_liked_message_ids(self):
+        """liked_message_ids returns only the liked ids among those asked about"""
+
+        self.u2.likes.append(self.m_u1)
+        db.session.commit()
+
+        self.assertEqual(
+            self.u2.liked_message_ids([self.m_u1.id, self.m_u2.id]),
+            {self.m_u1.id})
+        self.assertEqual(self.u.liked_message_ids([self.m_u1.id]), set())
+        self.assertEqual(self.u2.liked_message_ids([]), set())
+
+    def test_rebuild_caps_each_follow(self):
+        """rebuilding a timeline keeps only the newest messages of each user
+        followed, as following them does"""
+
+        db.session.add_all([
+            Message(text=f"Older{i}", user_id=self.u2.id,
+                    timestamp=datetime(2021, 1, 1) + timedelta(minutes=i))
+            for i in range(5)
+        ])
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        sum(TimelineEntry.rebuild(limit=3))
+
+        timeline = Message.query.join(
+            TimelineEntry, TimelineEntry.message_id == Message.id
+        ).filter(TimelineEntry.user_id == 1)
+        self.assertEqual(
+            sorted(m.text for m in timeline if m.user_id == 2),
+            ["Older3", "Older4", "TestMessage1"])
+        self.assertEqual(timeline.filter(Message.user_id == 1).count(), 1)
+
+    def test_rebuild_only_given_users(self):
+        """rebuilding some users' timelines leaves the others alone"""
+
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        sum(TimelineEntry.rebuild([1]))
+
+        self.assertEqual(
+            {entry.user_id for entry in TimelineEntry.query}, {1})
+
+    def test_rebuild_keeps_entries_fanned_out_meanwhile(self):
+        """a message fanned out while a batch is being rebuilt doesn't stop
+        the rebuild"""
+
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        posted = []
+
+        def post_message(conn, cursor, statement, *args):
+            # another request posts, and fans out, between the batch's delete
+            # and its insert
+            if posted or not statement.startswith("INSERT INTO timeline_entries"):
+                return
+            posted.append(True)
+
+            with db.engine.begin() as other:
+                message_id = other.execute(
+                    insert(Message).values(text="meanwhile", user_id=2,
+                                           timestamp=datetime.utcnow())
+                    .returning(Message.id)).scalar()
+                other.execute(insert(TimelineEntry).values(
+                    user_id=1, message_id=message_id,
+                    timestamp=datetime.utcnow()))
+
+        event.listen(db.engine, 'before_cursor_execute', post_message)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        post_message)
+
+        sum(TimelineEntry.rebuild([1]))
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=1).count(), 3)
@@ -8,8 +8,9 @@
 import os
 from unittest import TestCase
 from flask.helpers import get_flashed_messages
-from models import db, User, Message, Follows, Like
+from models import db, User, Message, Follows, Like, TimelineEntry
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +21,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, user_cache
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -140,6 +141,29 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertIn("test1234jdfhjkqhfjkew", html)
 
+    def test_posting_does_not_load_message_history(self):
+        """posting a message doesn't read the author's earlier messages"""
+
+        user_id = self.u.id
+        statements = []
+        record = lambda *args: statements.append(args[2])
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                client.post('/messages/new', data={"text": "no history"})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertFalse([statement for statement in statements
+                          if statement.startswith("SELECT")
+                          and "FROM messages" in statement])
+        self.assertEqual(Message.query.filter_by(text="no history").one()
+                         .user_id, user_id)
+
     def test_delete_own_message(self):
         """as a user, test delete a message for themself"""
 
@@ -181,4 +205,148 @@ class MessageViewTestCase(TestCase):
             
             self.assertEqual(response.status_code, 302)
             self.assertEqual(response.location, "http://localhost/")
-            self.assertIn("Access unauthorized.", get_flashed_messages())
\ No newline at end of file
+            self.assertIn("Access unauthorized.", get_flashed_messages())
+
+    def test_new_message_reaches_follower_timeline(self):
+        """a posted message shows up on the home timeline of the author's followers"""
+
+        self.u2.following.append(self.u)
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u.id
+
+            client.post('/messages/new', data = { "text" : "fan out test" })
+
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            response = client.get('/')
+            html = response.get_data(as_text=True)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("fan out test", html)
+
+    def test_homepage_query_count(self):
+        """the home page runs the same few queries however many messages,
+        and messages' authors, are on the timeline"""
+
+        def homepage_queries(client):
+            # start cold: the viewer and each message rendered afresh
+            user_cache.clear()
+            app.jinja_env.fragment_cache.clear()
+
+            statements = []
+            record = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = client.get('/')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(response.status_code, 200)
+            return len(statements)
+
+        user_id = self.u.id
+        liked_id = self.m_u2.id
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=user_id))
+        db.session.commit()
+        sum(TimelineEntry.rebuild([user_id]))
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            few = homepage_queries(client)
+
+            db.session.add_all([User(id=i, email=f"test{i}@test.com",
+                                     username=f"testuser{i}", password="x")
+                                for i in range(3, 8)])
+            db.session.commit()
+
+            for i in range(3, 8):
+                db.session.add(Follows(user_being_followed_id=i,
+                                       user_following_id=user_id))
+                db.session.add_all([Message(text=f"Message{i}.{j}", user_id=i)
+                                    for j in range(5)])
+            db.session.add(Like(user_id=user_id, message_id=liked_id))
+            db.session.commit()
+            sum(TimelineEntry.rebuild([user_id]))
+
+            many = homepage_queries(client)
+
+        self.assertEqual(many, few)
+        self.assertLessEqual(many, 4)
+
+    def test_like_and_unlike_message(self):
+        """PUT likes a message and DELETE unlikes it, each idempotently"""
+
+        message_id = self.m_u2.id
+        url = f'/messages/{message_id}/like'
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u.id
+
+            for _ in range(2):
+                response = client.put(url)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json(),
+                    { "liked" : True, "likes_count" : 1 })
+
+            self.assertEqual(User.query.get(1).likes_count, 1)
+
+            for _ in range(2):
+                response = client.delete(url)
+
+                self.assertEqual(response.get_json(),
+                    { "liked" : False, "likes_count" : 0 })
+
+            self.assertEqual(User.query.get(1).likes_count, 0)
+            self.assertEqual(client.put('/messages/999999/like').status_code, 404)
+
+    def test_cannot_like_deleted_authors_message(self):
+        """a message whose author's account is deleted can't be liked"""
+
+        message_id = self.m_u2.id
+        User.query.get(self.u2_id).mark_deleted()
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u.id
+
+            response = client.put(f'/messages/{message_id}/like')
+
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(Like.query.count(), 0)
+            self.assertEqual(User.query.get(1).likes_count, 0)
+
+    def test_show_message_not_modified(self):
+        """A message page is revalidated with its ETag, and changes to what
+        the viewer sees on it change the ETag"""
+
+        url = f'/messages/{self.m_u2.id}'
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u.id
+
+            response = client.get(url)
+            etag = response.headers['ETag']
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('private', response.headers['Cache-Control'])
+
+            response = client.get(url, headers={'If-None-Match': etag})
+
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+
+            client.put(f'{url}/like')
+            response = client.get(url, headers={'If-None-Match': etag})
+
+            self.assertEqual(response.status_code, 200)
@@ -0,0 +1,107 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+from datetime import datetime
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+from werkzeug.exceptions import BadRequest
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from pagination import paginate, encode_cursor, decode_cursor
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pagination of message listings."""
+
+    def setUp(self):
+        """Create a user with five messages, two sharing a timestamp."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+
+        u = User(
+            id = 1,
+            email="test@test.com",
+            username="testuser",
+            password="HASHED_PASSWORD"
+        )
+
+        db.session.add(u)
+        db.session.commit()
+
+        timestamps = [
+            datetime(2021, 1, 1),
+            datetime(2021, 1, 2),
+            datetime(2021, 1, 2),
+            datetime(2021, 1, 3),
+            datetime(2021, 1, 4),
+        ]
+
+        for i, timestamp in enumerate(timestamps):
+            db.session.add(Message(
+                id = i + 1,
+                text = f"TestMessage{i + 1}",
+                timestamp = timestamp,
+                user_id = u.id
+            ))
+
+        db.session.commit()
+
+        self.u = u
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cursor_round_trip(self):
+        """decode_cursor reverses encode_cursor"""
+
+        timestamp = datetime(2021, 10, 1, 12, 30, 15, 12345)
+        cursor = encode_cursor(timestamp, 42)
+
+        self.assertEqual(decode_cursor(cursor), (timestamp, 42))
+
+    def test_invalid_cursor(self):
+        """a garbled cursor is a bad request"""
+
+        with self.assertRaises(BadRequest):
+            decode_cursor("not-a-cursor")
+
+    def test_pages_cover_every_message_once(self):
+        """walking the pages returns each message once, newest first,
+        including messages that share a timestamp"""
+
+        query = Message.query.filter_by(user_id=self.u.id)
+        seen = []
+        cursor = None
+
+        while True:
+            page, cursor = paginate(
+                query, Message.timestamp, Message.id, cursor, per_page=2)
+            seen.extend(msg.id for msg in page)
+            if not cursor:
+                break
+
+        self.assertEqual(seen, [5, 4, 3, 2, 1])
+
+    def test_last_page_has_no_cursor(self):
+        """a page that reaches the end of the listing has no next cursor"""
+
+        page, cursor = paginate(
+            Message.query.filter_by(user_id=self.u.id),
+            Message.timestamp,
+            Message.id,
+            per_page=5)
+
+        self.assertEqual(len(page), 5)
+        self.assertIsNone(cursor)
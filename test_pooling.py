@@ -0,0 +1,65 @@
+"""Connection pool settings and metrics tests."""
+
+import os
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, exc
+
+from app import app, env_flag
+from metrics import registry
+import pooling
+
+
+class PoolingTestCase(TestCase):
+    """Test the pool options and the metrics the pool records."""
+
+    def setUp(self):
+        self.engine = create_engine(
+            app.config['SQLALCHEMY_DATABASE_URI'],
+            **pooling.engine_options(size=1, max_overflow=0, timeout=0.1),
+            pool_logging_name='test')
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_pgbouncer_mode_keeps_few_idle(self):
+        """behind PgBouncer few connections are kept idle, the capacity is
+        unchanged, and the pool still records metrics"""
+
+        options = pooling.engine_options(size=5, max_overflow=10,
+                                         pgbouncer=True)
+
+        self.assertIs(options['poolclass'], pooling.InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], pooling.PGBOUNCER_IDLE)
+        self.assertEqual(options['pool_size'] + options['max_overflow'], 15)
+
+    def test_env_flag(self):
+        """pool switches are on only for an explicit yes"""
+
+        for value, expected in [('1', True), ('true', True), ('Yes', True),
+                                ('0', False), ('false', False), ('', False)]:
+            with patch.dict(os.environ, DB_PGBOUNCER=value):
+                self.assertIs(env_flag('DB_PGBOUNCER'), expected, value)
+
+    def test_checkout_metrics(self):
+        """checkouts, waits and timeouts show up on /metrics"""
+
+        with self.engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+
+            metrics = registry.render()
+
+        self.assertIn('warbler_db_pool_checked_out{pool="test"} 1', metrics)
+        self.assertIn('warbler_db_pool_capacity{pool="test"} 1', metrics)
+        self.assertIn(
+            'warbler_db_pool_checkout_timeouts_total{pool="test"} 1', metrics)
+        self.assertIn(
+            'warbler_db_pool_checkout_wait_seconds_count{pool="test"} 2',
+            metrics)
+        self.assertIn('warbler_db_pool_checked_out{pool="test"} 0',
+                      registry.render())
@@ -0,0 +1,191 @@
+"""Read replica routing tests."""
+
+import os
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, g
+from sqlalchemy import event, exc, text, update
+
+from app import app
+from models import db, User
+from replicas import Replica, ReplicaSet, Replicas
+
+db.create_all()
+
+
+class FakeClock:
+    """A clock the tests move by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeReplica:
+    """A replica whose lag the test sets."""
+
+    def __init__(self, name, lag=0):
+        self.engine = name
+        self.lag = lag
+        self.healthy = True
+        self.checks = 0
+
+    def check(self, max_lag):
+        self.checks += 1
+        self.healthy = self.lag <= max_lag
+
+
+def run_now(check):
+    """Run a check straight away instead of in a thread."""
+
+    check()
+
+
+class ReplicaSetTestCase(TestCase):
+    """Test health checks and choosing a replica."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.fast = FakeReplica("fast")
+        self.slow = FakeReplica("slow", lag=30)
+        self.replica_set = ReplicaSet(
+            [self.fast, self.slow], max_lag=5, check_interval=10,
+            clock=self.clock, spawn=run_now)
+
+    def test_lagging_replica_dropped(self):
+        """only replicas within max_lag are chosen"""
+
+        for _ in range(20):
+            self.assertEqual(self.replica_set.choose(), "fast")
+
+    def test_checks_every_interval(self):
+        """replicas are checked again once check_interval has passed"""
+
+        self.replica_set.choose()
+        self.replica_set.choose()
+        self.assertEqual(self.fast.checks, 1)
+
+        self.fast.lag = 30
+        self.clock.now = 10
+
+        self.assertIsNone(self.replica_set.choose())
+        self.assertEqual(self.fast.checks, 2)
+
+    def test_choose_does_not_wait_for_check(self):
+        """a due check is handed off, and choosing uses the last results
+        until it has run"""
+
+        spawned = []
+        self.replica_set.spawn = spawned.append
+        self.slow.healthy = False
+        self.slow.lag = 0
+
+        self.assertEqual(self.replica_set.choose(), "fast")
+        self.replica_set.choose()
+        self.assertEqual(len(spawned), 1)
+        self.assertEqual(self.slow.checks, 0)
+
+        spawned[0]()
+
+        self.assertEqual(self.slow.checks, 1)
+        self.assertTrue(self.slow.healthy)
+
+
+class RoutingSessionTestCase(TestCase):
+    """Test which engine the session's statements go to."""
+
+    def setUp(self):
+        self.replica = Replica(app.config['SQLALCHEMY_DATABASE_URI'])
+        self.replica_statements = []
+        event.listen(self.replica.engine, 'before_cursor_execute',
+                     lambda *args: self.replica_statements.append(args[2]))
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+        self.replica.engine.dispose()
+
+    def test_reads_from_replica_writes_to_primary(self):
+        """queries go to the request's replica; flushes and UPDATEs don't"""
+
+        with app.test_request_context('/'):
+            g.db_replica = self.replica.engine
+
+            User.query.all()
+            self.assertEqual(len(self.replica_statements), 1)
+
+            db.session.add(User(id=9999, username="routed",
+                                email="routed@test.com", password="x"))
+            db.session.flush()
+            db.session.execute(update(User).values(bio="routed"))
+
+            self.assertEqual(len(self.replica_statements), 1)
+
+    def test_replica_check(self):
+        """a server that isn't in recovery has no lag"""
+
+        self.assertFalse(self.replica.healthy)
+
+        self.replica.check(max_lag=5)
+
+        self.assertEqual(self.replica.lag, 0)
+        self.assertTrue(self.replica.healthy)
+
+    def test_replica_not_streaming(self):
+        """a replica whose lag can't be measured, as when it has stopped
+        receiving WAL, is left out"""
+
+        with patch('replicas.LAG_QUERY', text("SELECT NULL")):
+            self.replica.check(max_lag=5)
+
+        self.assertIsNone(self.replica.lag)
+        self.assertFalse(self.replica.healthy)
+
+    def test_statement_timeout(self):
+        """statements on a replica are cancelled after its timeout"""
+
+        replica = Replica(app.config['SQLALCHEMY_DATABASE_URI'],
+                          statement_timeout=0.1)
+
+        try:
+            with replica.engine.connect() as connection:
+                with self.assertRaises(exc.OperationalError):
+                    connection.execute(text("SELECT pg_sleep(1)"))
+        finally:
+            replica.engine.dispose()
+
+
+class PinningTestCase(TestCase):
+    """Test read-your-writes pinning to the primary."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = "test"
+        self.app.config['SQLALCHEMY_REPLICA_URLS'] = [
+            app.config['SQLALCHEMY_DATABASE_URI']]
+        self.app.config['REPLICA_PIN_SECONDS'] = 60
+
+        @self.app.route('/', methods=['GET', 'POST'])
+        def reads_from():
+            return "replica" if g.get('db_replica') is not None else "primary"
+
+        self.replicas = Replicas(self.app)
+        self.replicas.replica_set.spawn = run_now
+
+    def tearDown(self):
+        for replica in self.replicas.replica_set.replicas:
+            replica.engine.dispose()
+
+    def test_pinned_after_write(self):
+        """reads go to a replica until the user writes something"""
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.get('/').get_data(as_text=True), "replica")
+            self.assertEqual(client.post('/').get_data(as_text=True), "primary")
+            self.assertEqual(client.get('/').get_data(as_text=True), "primary")
@@ -0,0 +1,67 @@
+"""Lazy request globals tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_request_globals.py
+
+
+from unittest import TestCase
+
+from flask import Flask, g
+
+from request_globals import LazyAppGlobals
+
+
+class LazyAppGlobalsTestCase(TestCase):
+    """Test that lazy attributes on g are loaded on first use only."""
+
+    def setUp(self):
+        class Globals(LazyAppGlobals):
+            loaders = {}
+
+        self.loads = 0
+
+        @Globals.lazy('thing')
+        def load_thing():
+            self.loads += 1
+            return "loaded"
+
+        self.app = Flask(__name__)
+        self.app.app_ctx_globals_class = Globals
+
+        @self.app.route('/unused')
+        def unused():
+            return "ok"
+
+        @self.app.route('/used')
+        def used():
+            return g.thing + g.thing
+
+    def test_not_loaded_unless_used(self):
+        """a request that never reads the attribute never loads it"""
+
+        self.app.test_client().get('/unused')
+
+        self.assertEqual(self.loads, 0)
+
+    def test_loaded_once_per_request(self):
+        """the loader runs on first read, and its result is reused for the
+        rest of the request"""
+
+        client = self.app.test_client()
+
+        self.assertEqual(client.get('/used').get_data(as_text=True),
+                         "loadedloaded")
+        self.assertEqual(self.loads, 1)
+
+        client.get('/used')
+
+        self.assertEqual(self.loads, 2)
+
+    def test_unknown_attribute(self):
+        """attributes with no loader are missing as usual"""
+
+        with self.app.app_context():
+            self.assertIsNone(g.get('other'))
+            with self.assertRaises(AttributeError):
+                g.other
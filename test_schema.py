@@ -0,0 +1,101 @@
+"""Schema checks tests."""
+
+import os
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from unittest import TestCase
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import text
+
+from app import app
+from models import db
+import schema
+
+db.create_all()
+
+
+class IndexDriftTestCase(TestCase):
+    """Comparing the database's indexes with the models'"""
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_no_drift(self):
+        """A database created from the models matches them"""
+
+        self.assertEqual(schema.index_drift(), [])
+
+    def test_missing_and_unexpected(self):
+        """Indexes only in the models, or only in the database, are reported"""
+
+        db.session.execute(text("DROP INDEX ix_likes_message_id"))
+        db.session.execute(text("CREATE INDEX ix_users_bio ON users (bio)"))
+
+        self.assertEqual(schema.index_drift(), [
+            "missing: ix_likes_message_id on likes",
+            "unexpected: ix_users_bio on users",
+        ])
+
+    def test_different_columns(self):
+        """An index on other columns than the model's is reported"""
+
+        db.session.execute(text("DROP INDEX ix_likes_message_id"))
+        db.session.execute(
+            text("CREATE INDEX ix_likes_message_id ON likes (message_id)"))
+
+        self.assertEqual(schema.index_drift(), [
+            "different columns: ix_likes_message_id is on (message_id), "
+            "not (message_id, user_id)",
+        ])
+
+
+class BuildIndexConcurrentlyTestCase(TestCase):
+    """Building a migration's index concurrently"""
+
+    def setUp(self):
+        self.connection = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        self.op = Operations(MigrationContext.configure(self.connection))
+
+    def tearDown(self):
+        self.connection.execute(text("DROP INDEX IF EXISTS ix_users_bio"))
+        self.connection.close()
+
+    def index_oid(self):
+        return self.connection.execute(
+            text("SELECT to_regclass('ix_users_bio')::oid")).scalar()
+
+    def test_builds_missing_index(self):
+        """An index that isn't there is built"""
+
+        schema.build_index_concurrently(self.op, 'ix_users_bio', 'users', ['bio'])
+
+        self.assertIsNotNone(self.index_oid())
+
+    def test_keeps_valid_index(self):
+        """A valid index is left as it is, not rebuilt"""
+
+        self.connection.execute(text("CREATE INDEX ix_users_bio ON users (bio)"))
+        oid = self.index_oid()
+
+        schema.build_index_concurrently(self.op, 'ix_users_bio', 'users', ['bio'])
+
+        self.assertEqual(self.index_oid(), oid)
+
+    def test_rebuilds_invalid_index(self):
+        """An invalid index, as a failed concurrent build leaves, is rebuilt"""
+
+        self.connection.execute(text("CREATE INDEX ix_users_bio ON users (bio)"))
+        oid = self.index_oid()
+        self.connection.execute(text(
+            "UPDATE pg_index SET indisvalid = false WHERE indexrelid = :oid"),
+            {'oid': oid})
+
+        schema.build_index_concurrently(self.op, 'ix_users_bio', 'users', ['bio'])
+
+        self.assertNotEqual(self.index_oid(), oid)
+        self.assertTrue(self.connection.execute(schema.INDEX_VALID,
+                                                {'name': 'ix_users_bio'}).scalar())
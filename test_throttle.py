@@ -0,0 +1,70 @@
+"""Login throttle tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_throttle.py
+
+
+from unittest import TestCase
+
+from throttle import TokenBucketLimiter
+
+
+class FakeClock:
+    """A clock the tests move by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketLimiterTestCase(TestCase):
+    """Test bursts, refills and eviction of TokenBucketLimiter."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = TokenBucketLimiter(
+            rate=1, burst=3, maxsize=2, clock=self.clock)
+
+    def test_burst_then_wait(self):
+        """a key gets `burst` attempts, then must wait for a refill"""
+
+        for _ in range(3):
+            self.assertEqual(self.limiter.acquire("a"), 0)
+
+        self.assertEqual(self.limiter.acquire("a"), 1)
+
+        self.clock.now = 1
+        self.assertEqual(self.limiter.acquire("a"), 0)
+
+    def test_keys_are_independent(self):
+        """one key running out does not affect another"""
+
+        for _ in range(4):
+            self.limiter.acquire("a")
+
+        self.assertEqual(self.limiter.acquire("b"), 0)
+
+    def test_reset(self):
+        """reset refills a key's bucket"""
+
+        for _ in range(4):
+            self.limiter.acquire("a")
+
+        self.limiter.reset("a")
+
+        self.assertEqual(self.limiter.acquire("a"), 0)
+
+    def test_eviction(self):
+        """the least recently used key is evicted once maxsize is reached"""
+
+        self.limiter.acquire("a")
+        self.limiter.acquire("b")
+        self.limiter.acquire("a")
+        self.limiter.acquire("c")
+
+        self.assertEqual(len(self.limiter), 2)
+        self.assertEqual(self.limiter.evictions, 1)
+        self.assertNotIn("b", self.limiter._buckets)
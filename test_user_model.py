@@ -8,7 +8,8 @@
 import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows
+from models import db, hasher, User, Message, Follows
+from hashing import hash_cost
 from flask_bcrypt import Bcrypt
 from sqlalchemy import exc
 
@@ -158,4 +159,51 @@ class UserModelTestCase(TestCase):
         self.assertFalse(user)
 
         user = User.authenticate(self.u2.username, "bazinga")
-        self.assertFalse(user)
\ No newline at end of file
+        self.assertFalse(user)
+
+    def test_authentication_upgrades_weak_hash(self):
+        """a hash made at a lower cost is replaced on successful login"""
+
+        self.u.password = bcrypt.generate_password_hash(
+            "HASHED_PASSWORD", rounds=4).decode('UTF-8')
+        db.session.commit()
+
+        user = User.authenticate(self.u.username, "HASHED_PASSWORD")
+
+        self.assertEqual(user, self.u)
+        self.assertEqual(hash_cost(user.password), hasher.rounds)
+        self.assertTrue(bcrypt.check_password_hash(user.password, "HASHED_PASSWORD"))
+
+    def test_reconcile_counts(self):
+        """reconcile_counts repairs counters that drifted from the follows table"""
+
+        follow = Follows(
+            user_being_followed_id=self.u2.id,
+            user_following_id=self.u.id)
+
+        db.session.add(follow)
+        db.session.commit()
+
+        self.assertEqual(self.u.following_count, 0)
+
+        repaired = sum(User.reconcile_counts())
+        db.session.expire_all()
+
+        self.assertEqual(repaired, 2)
+        self.assertEqual(self.u.following_count, 1)
+        self.assertEqual(self.u2.followers_count, 1)
+
+    def test_following_ids_among(self):
+        """following_ids_among returns only the followed ids among those asked about"""
+
+        follow = Follows(
+            user_being_followed_id=self.u2.id,
+            user_following_id=self.u.id)
+
+        db.session.add(follow)
+        db.session.commit()
+
+        self.assertEqual(
+            self.u.following_ids_among([self.u.id, self.u2.id]), {self.u2.id})
+        self.assertEqual(self.u2.following_ids_among([self.u.id]), set())
+        self.assertEqual(self.u.following_ids_among([]), set())
@@ -5,12 +5,13 @@ import os
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from unittest import TestCase
+from unittest.mock import patch
 from flask.helpers import get_flashed_messages
-from app import app, do_login
+from app import app, do_login, login_user_limiter, user_cache, CURR_USER_KEY
 from flask import flash
 from flask_bcrypt import Bcrypt
-from models import db, User, Message, Follows, Like
-from sqlalchemy import exc
+from models import db, User, Message, Follows, Like, TimelineEntry
+from sqlalchemy import event, exc
 
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///warbler-test'
 app.config['SQLALCHEMY_ECHO'] = False
@@ -169,3 +170,368 @@ class UserViewTestCase(TestCase):
             self.assertIn('Access unauthorized.', get_flashed_messages())
 
 
+
+    def test_follow_updates_counters(self):
+        """Make sure following and unfollowing keep both users' counters in sync"""
+
+        with self.client as client:
+
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+
+            client.post("/users/follow/2")
+
+            self.assertEqual(User.query.get(1).following_count, 1)
+            self.assertEqual(User.query.get(2).followers_count, 1)
+
+            client.post("/users/stop-following/2")
+
+            self.assertEqual(User.query.get(1).following_count, 0)
+            self.assertEqual(User.query.get(2).followers_count, 0)
+
+    def test_follow_without_loading_follows(self):
+        """Following and unfollowing write the follow directly, without
+        reading who the user already follows, and count each change once"""
+
+        statements = []
+        record = lambda *args: statements.append(args[2])
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                client.post("/users/follow/2")
+                client.post("/users/follow/2")
+                client.post("/users/stop-following/2")
+                client.post("/users/stop-following/2")
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertFalse([statement for statement in statements
+                          if statement.startswith("SELECT")
+                          and "follows" in statement])
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(User.query.get(1).following_count, 0)
+        self.assertEqual(User.query.get(2).followers_count, 0)
+
+    def test_unfollow_removes_messages_from_timeline(self):
+        """Make sure following fills the home timeline and unfollowing prunes it"""
+
+        with self.client as client:
+
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+
+            client.post("/users/follow/2")
+            html = client.get("/").get_data(as_text=True)
+
+            self.assertIn("TestMessage2", html)
+
+            client.post("/users/stop-following/2")
+            html = client.get("/").get_data(as_text=True)
+
+            self.assertNotIn("TestMessage2", html)
+
+    def test_search_users(self):
+        """Make sure searching ranks matching usernames and excludes others"""
+
+        with self.client as client:
+
+            response = client.get("/users?q=user2")
+            html = response.get_data(as_text=True)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('@testuser2', html)
+            self.assertNotIn('@testuser<', html)
+
+    def test_typeahead(self):
+        """Make sure typeahead suggests usernames by prefix, as JSON"""
+
+        with self.client as client:
+
+            response = client.get("/users/typeahead?q=TESTUSER2")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.get_json(),
+                {"users": [{
+                    "id": 2,
+                    "username": "testuser2",
+                    "image_url": "/static/images/default-pic.png",
+                }]})
+
+            response = client.get("/users/typeahead?q=test")
+
+            self.assertEqual(
+                [user["username"] for user in response.get_json()["users"]],
+                ["testuser", "testuser2"])
+
+            response = client.get("/users/typeahead?q=nobody")
+
+            self.assertEqual(response.get_json(), {"users": []})
+
+    def test_short_search_in_prefix_order(self):
+        """Terms too short for trigrams list prefix matches, an exact match
+        first"""
+
+        db.session.add(User(id=9001, email="t@test.com", username="te",
+                            password="x"))
+        db.session.add(User(id=9002, email="t2@test.com", username="teZ",
+                            password="x"))
+        db.session.commit()
+
+        self.assertEqual([user.username for user in User.search("TE")],
+                         ["te", "testuser", "testuser2", "teZ"])
+
+    def test_user_directory(self):
+        """Make sure the directory lists users, continuing after a given id"""
+
+        with self.client as client:
+
+            html = client.get("/users").get_data(as_text=True)
+
+            self.assertIn('@testuser<', html)
+            self.assertIn('@testuser2<', html)
+
+            html = client.get("/users?after=1").get_data(as_text=True)
+
+            self.assertNotIn('@testuser<', html)
+            self.assertIn('@testuser2<', html)
+
+    def test_login_throttled_before_authenticating(self):
+        """Repeated logins for one username are turned away with a 429,
+        without checking the password"""
+
+        self.addCleanup(login_user_limiter.reset, "nobody")
+
+        with self.client as client:
+            data = {"username": "nobody", "password": "password"}
+
+            for _ in range(login_user_limiter.burst):
+                response = client.post('/login', data=data)
+                self.assertEqual(response.status_code, 200)
+
+            with patch.object(User, 'authenticate') as authenticate:
+                response = client.post('/login', data=data)
+
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response.headers)
+            authenticate.assert_not_called()
+
+            metrics = client.get('/metrics').get_data(as_text=True)
+
+            self.assertIn(
+                'warbler_login_attempts_total{outcome="throttled"}', metrics)
+
+    def test_server_timing(self):
+        """Sampled responses report their SQL and template timings"""
+
+        with self.client as client, \
+                patch('instrumentation.random.random', return_value=0):
+            response = client.get(f"/users/{self.u.id}")
+
+            timing = response.headers['Server-Timing']
+            self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+            self.assertIn('tpl;dur=', timing)
+
+    def test_profile_messages_follow_author_edits(self):
+        """Cached message items are re-rendered when the author changes
+        their username"""
+
+        db.session.add(Message(text="fragment test", user_id=self.u.id))
+        db.session.commit()
+
+        with self.client as client:
+            html = client.get(f"/users/{self.u.id}").get_data(as_text=True)
+            self.assertIn('@testuser</a>', html)
+
+            self.u.username = "renamed"
+            db.session.commit()
+
+            html = client.get(f"/users/{self.u.id}").get_data(as_text=True)
+            self.assertIn('@renamed</a>', html)
+            self.assertNotIn('@testuser</a>', html)
+
+    def test_current_user_loaded_only_when_used(self):
+        """A logged-in request that never reads g.user doesn't load it"""
+
+        user_id = self.u.id
+        user_cache.clear()
+        statements = []
+        record = lambda *args: statements.append(args[2])
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                client.get('/metrics')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(statements, [])
+        self.assertIsNone(user_cache.get(user_id))
+
+    def test_profile_edit_refreshes_cached_user(self):
+        """Editing the profile drops the cached copy of the user, so the
+        next page shows the change"""
+
+        user_id = self.u.id
+
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            html = client.get(f"/users/{user_id}").get_data(as_text=True)
+            self.assertIn('alt="testuser"', html)
+            self.assertEqual(user_cache.get(user_id)['username'], "testuser")
+
+            client.post('/users/profile', data={
+                "username": "renamed",
+                "email": "test@test.com",
+                "password": "password",
+            })
+
+            html = client.get(f"/users/{user_id}").get_data(as_text=True)
+            self.assertIn('alt="renamed"', html)
+            self.assertEqual(user_cache.get(user_id)['username'], "renamed")
+
+    def make_connections(self):
+        """testuser and testuser2 follow each other and like each other's
+        message; the counters are brought up to date"""
+
+        db.session.add_all([
+            Follows(user_being_followed_id=1, user_following_id=2),
+            Follows(user_being_followed_id=2, user_following_id=1),
+            Like(user_id=1, message_id=self.m_u2.id),
+            Like(user_id=2, message_id=self.m_u1.id),
+        ])
+        db.session.commit()
+
+        for model in (User, Message):
+            list(model.reconcile_counts())
+
+    def assert_connections_gone(self):
+        """Nothing of testuser's is left, and testuser2's counters no longer
+        count it"""
+
+        db.session.expire_all()
+        u2 = User.query.get(2)
+
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual(Message.query.filter_by(user_id=1).count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(
+            (u2.followers_count, u2.following_count, u2.likes_count), (0, 0, 0))
+        self.assertEqual(Message.query.filter_by(user_id=2).one().likes_count, 0)
+
+    def test_delete_user(self):
+        """Deleting a small account removes it and everything of theirs at
+        once"""
+
+        self.make_connections()
+
+        with self.client as client:
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+            response = client.post("/users/1/delete")
+
+            self.assertEqual(response.location, "http://localhost/signup")
+
+        self.assert_connections_gone()
+
+    def test_delete_large_user_is_purged_later(self):
+        """A large account is hidden at once and removed by the purge"""
+
+        self.make_connections()
+
+        with self.client as client, \
+                patch.dict(app.config, DELETE_INLINE_MAX_ROWS=0):
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+            client.post("/users/1/delete")
+
+            self.assertIsNotNone(User.query.get(1).deleted_at)
+            self.assertEqual(client.get("/users/1").status_code, 404)
+            self.assertEqual(User.followers_of(2).count(), 0)
+
+            response = client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+            self.assertIn("Invalid credentials.", get_flashed_messages())
+
+        steps = [step for step, deleted in User.purge(1, batch_size=1)]
+
+        self.assertEqual(steps[-1], 'user')
+        self.assert_connections_gone()
+
+    def test_cannot_follow_self(self):
+        """Following yourself is refused"""
+
+        with self.client as client:
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+            client.post("/users/follow/1")
+
+            self.assertIn("You can't follow yourself.", get_flashed_messages())
+
+        self.assertEqual(Follows.query.count(), 0)
+
+    def test_existing_self_follow_keeps_timelines_working(self):
+        """A self-follow left from before doesn't break posting, rebuilding
+        or unfollowing"""
+
+        db.session.add(Follows(user_being_followed_id=1, user_following_id=1))
+        db.session.commit()
+
+        with self.client as client:
+            client.post(
+                '/login',
+                data = {
+                    "username" : self.u.username,
+                    "password" : "password"
+                    },
+                )
+
+            response = client.post("/messages/new", data={"text": "self post"})
+            self.assertEqual(response.status_code, 302)
+
+            list(TimelineEntry.rebuild())
+
+            client.post("/users/stop-following/1")
+            html = client.get("/").get_data(as_text=True)
+
+            self.assertIn("self post", html)
@@ -0,0 +1,64 @@
+"""Token-bucket rate limiting for expensive endpoints such as login."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TokenBucketLimiter:
+    """Allow each key `burst` attempts at once, refilled at `rate` attempts
+    per second.
+
+    Buckets live in this process and are capped at `maxsize` keys; the least
+    recently used are evicted, which just forgives that key. Safe to share
+    between threads. A limiter shared between processes only needs to
+    provide the same `acquire` and `reset`.
+    """
+
+    def __init__(self, rate, burst, maxsize=10000, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.clock = clock
+        self.evictions = 0
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, key):
+        """Take one token from `key`'s bucket.
+
+        Returns 0 if the attempt is allowed, otherwise the number of seconds
+        until it would be.
+        """
+
+        if self.burst <= 0:
+            return 0
+
+        now = self.clock()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+
+        return wait
+
+    def reset(self, key):
+        """Refill `key`'s bucket, e.g. after a successful login."""
+
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)